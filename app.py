@@ -1,25 +1,48 @@
+from startup import StartupProfile, create_health_router
+
+# Bắt đầu đo trước khi import gradio (phần chậm nhất của cold start)
+startup_profile = StartupProfile()
+
 import gradio as gr
-import requests
+import asyncio
 import json
 import os
+import re
 import hashlib
+import mimetypes
+import secrets
 import time
-from PIL import Image
+import uuid
+from PIL import Image, ImageOps
 from pathlib import Path
 from io import BytesIO
-from groq import Groq
-from dotenv import load_dotenv
+from resource_cache import ResourceCache, RESOURCE_EXPIRE_SEC
+from readiness import ReadinessStats, POLICIES
+from job_engine import JobEngine, JobFailed, JobTimeout, NON_TERMINAL_STATUSES
+from job_journal import JobJournal
+from tensorart_client import TensorArtClient
+from webhook import callback_url, create_callback_router
+from result_cache import ResultCache, make_key
+from build_catalog import load_or_build_index
+from image_store import ImageStore
+from workflow_validator import ParamsChecker
+from workflow_templates import TemplateRegistry
+from scheduler import FairScheduler, QueueFull, PRIORITY_HIGH, PRIORITY_NORMAL
+import telemetry
+from telemetry import metrics, span
+
+startup_profile.mark("imports")
 
 if os.path.exists('.env'):
+    from dotenv import load_dotenv
     load_dotenv()
 else:
     print("Warning: .env file not found. Using default environment variables.")
 
 # Get environment variables with fallback
 api_key_token = os.getenv('api_key_token', '')
-groq_api_key = os.getenv('groq_api_key', '')
 
-if not api_key_token or not groq_api_key:
+if not api_key_token:
     raise ValueError("Please configure your API keys in .env file")
 
 # Ghi log khởi động
@@ -27,336 +50,456 @@ print("Version 2.19 - Fixed RGBA to RGB conversion for JPEG")
 print("Running grok_app.py with workflow processing and .env configuration")
 
 # URL và thông tin cá nhân từ API
-url_pre = "https://ap-east-1.tensorart.cloud/v1"
+url_pre = os.getenv('TENSORART_API_URL', "https://ap-east-1.tensorart.cloud/v1")
+# Client HTTP dùng chung (connection pool, timeout, retry, header xác thực)
+tensorart = TensorArtClient(url_pre, api_key_token)
 SAVE_DIR = "generated_images"
-Path(SAVE_DIR).mkdir(exist_ok=True)
-
-# Danh sách mã sản phẩm
-PRODUCT_GROUPS = {
-    "Standard": {
-        "C1012 Glacier White": "817687427545199895",
-        "C1026 Polar": "819910519797326073",
-        "C3269 Ash Grey": "821839484099264081",
-        "C3168 Silver Wave": "821849044696643212",
-        "C1005 Milky White": "821948258441171133",
-    },
-    "Deluxe": {
-        "C2103 Onyx Carrara": "827090618489513527",
-        "C2104 Massa": "822075428127644644",
-        "C3105 Casla Cloudy": "828912225788997963",
-        "C3146 Casla Nova": "828013009961087650",
-        "C2240 Marquin": "828085015087780649",
-        "C2262 Concrete (Honed)": "822211862058871636",
-        "C3311 Calacatta Sky": "829984593223502930",
-        "C3346 Massimo": "827938741386607132",
-    },
-    "Luxury": {
-        "C4143 Mario": "829984593223502930",
-        "C4145 Marina": "828132560375742058",
-        "C4202 Calacatta Gold": "828167757632695310",
-        "C1205 Casla Everest": "828296778450463190",
-        "C4211 Calacatta Supreme": "828436321937882328",
-        "C4204 Calacatta Classic": "828422973179466146",
-        "C5240 Spring": "is coming",
-        "C1102 Super White": "828545723344775887",
-        "C4246 Casla Mystery": "828544778451950698",
-        "C4345 Oro": "828891068780182635",
-        "C4346 Luxe": "829436426547535131",
-        "C4342 Casla Eternal": "829190256201829181",
-        "C4221 Athena": "829644354504131520",
-        "C4222 Lagoon": "is coming",
-        "C5225 Amber": "is coming",
-    },
-    "Super Luxury": {
-        "C4255 Calacatta Extra": "829659013227537217",
-    },
-}
-
-# Danh sách ảnh sản phẩm tương ứng với mã sản phẩm
-PRODUCT_IMAGE_MAP = {
-    "C1012 Glacier White": "product_images/C1012.jpg",
-    "C1026 Polar": "product_images/C1026.jpg",
-    "C3269 Ash Grey": "product_images/C3269.jpg",
-    "C3168 Silver Wave": "product_images/C3168.jpg",
-    "C1005 Milky White": "product_images/C1005.jpg",
-    "C2103 Onyx Carrara": "product_images/C2103.jpg",
-    "C2104 Massa": "product_images/C2104.jpg",
-    "C3105 Casla Cloudy": "product_images/C3105.jpg",
-    "C3146 Casla Nova": "product_images/C3146.jpg",
-    "C2240 Marquin": "product_images/C2240.jpg",
-    "C2262 Concrete (Honed)": "product_images/C2262.jpg",
-    "C3311 Calacatta Sky": "product_images/C3311.jpg",
-    "C3346 Massimo": "product_images/C3346.jpg",
-    "C4143 Mario": "product_images/C4143.jpg",
-    "C4145 Marina": "product_images/C4145.jpg",
-    "C4202 Calacatta Gold": "product_images/C4202.jpg",
-    "C1205 Casla Everest": "product_images/C1205.jpg",
-    "C4211 Calacatta Supreme": "product_images/C4211.jpg",
-    "C4204 Calacatta Classic": "product_images/C4204.jpg",
-    "C1102 Super White": "product_images/C1102.jpg",
-    "C4246 Casla Mystery": "product_images/C4246.jpg",
-    "C4345 Oro": "product_images/C4345.jpg",
-    "C4346 Luxe": "product_images/C4346.jpg",
-    "C4342 Casla Eternal": "product_images/C4342.jpg",
-    "C4221 Athena": "product_images/C4221.jpg",
-    "C4255 Calacatta Extra": "product_images/C4255.jpg",
+# Ảnh sinh ra: tên theo hash nội dung, ghi nền, giới hạn dung lượng/tuổi (LRU)
+image_store = ImageStore(SAVE_DIR, int(os.getenv('GENERATED_MAX_MB', '2000')) * 1024 * 1024,
+                         float(os.getenv('GENERATED_MAX_AGE_DAYS', '7')) * 86400)
+CACHE_DIR = "cache"
+Path(CACHE_DIR).mkdir(exist_ok=True)
+
+# Thống kê thời gian sẵn sàng thực tế của resource/job để chỉnh lại backoff
+readiness_stats = ReadinessStats(Path(CACHE_DIR) / "readiness_stats.jsonl")
+# Lỗi TensorArt khi job dùng resource chưa đồng bộ xong (vừa PUT); job được gửi lại theo backoff "resource"
+RESOURCE_NOT_READY = re.compile(r'resource.*(not found|not exist|not ready|does not)', re.IGNORECASE)
+
+# Danh mục sản phẩm: index build sẵn bởi build_catalog.py từ product_catalog.json
+# (mã, nhóm, model ID, texture, hash, kích thước, thumbnail)
+CATALOG_INDEX = load_or_build_index()
+CATALOG_ENTRIES = {entry['label']: entry for entry in CATALOG_INDEX['products']}
+# Sản phẩm có texture dùng được cho Img2Img, theo nhãn hiển thị trên UI ("C1012 Glacier White")
+PRODUCT_CATALOG = {label: entry for label, entry in CATALOG_ENTRIES.items() if entry['available']}
+
+# Nhãn sản phẩm theo từng nhóm, đúng thứ tự trong danh mục; nhóm không còn sản phẩm nào thì ẩn
+def group_labels(entries):
+    groups = {}
+    for group in CATALOG_INDEX['groups']:
+        labels = [label for label, entry in entries.items() if entry['group'] == group['name']]
+        if labels:
+            groups[group['name']] = labels
+    return groups
+
+# Text2Img chỉ cần model ID (không dùng ảnh sản phẩm); Img2Img cần thêm texture
+TXT2IMG_PRODUCT_GROUPS = group_labels({label: entry for label, entry in CATALOG_ENTRIES.items() if entry['model_id']})
+IMG2IMG_PRODUCT_GROUPS = group_labels(PRODUCT_CATALOG)
+
+# Kích thước ảnh gốc mà workflow cần (node 2 và max_megapixels của node 1)
+INPUT_WIDTH = 768
+INPUT_HEIGHT = 1024
+INPUT_MAX_MEGAPIXELS = 2
+INPUT_JPEG_QUALITY = 90
+
+# Số sản phẩm Img2Img được chạy song song trong một request
+MAX_PARALLEL_PRODUCTS = 4
+# Số biến thể Text2Img tối đa trong một job (INPUT_INITIALIZE count)
+MAX_TXT2IMG_BATCH = 4
+
+# Graph workflow Img2Img nạp từ workflows/*.json (có phiên bản, chọn theo bề mặt)
+workflow_templates = TemplateRegistry()
+# Các template quyết định kết quả Img2Img; phiên bản của chúng nằm trong key cache
+IMG2IMG_TEMPLATES = ("mask", "paste", "paste_pretiled", "full", "full_pretiled")
+# Cache kết quả Img2Img theo (ảnh, vị trí, sản phẩm, phiên bản workflow); file nằm trong image_store
+result_cache = ResultCache(Path(CACHE_DIR) / "img2img_results.json",
+                           int(os.getenv('RESULT_CACHE_MAX_MB', '500')) * 1024 * 1024, owns_files=False)
+# Mask bề mặt theo (ảnh, vị trí): file mask trên đĩa và resourceId của nó trên TensorArt
+mask_cache = ResultCache(Path(CACHE_DIR) / "masks.json", int(os.getenv('MASK_CACHE_MAX_MB', '200')) * 1024 * 1024,
+                         owns_files=False)
+
+# Tham số diffusion cố định của Text2Img; mọi thay đổi ở đây cũng đổi key cache
+TXT2IMG_SETTINGS = {
+    "sdModel": "779398605850080514",
+    "sdVae": "ae.sft",
+    "sampler": "Euler a",
+    "steps": 30,
+    "cfgScale": 8,
+    "clipSkip": 1,
+    "etaNoiseSeedDelta": 31337,
 }
-
-# Định nghĩa màu sắc cho từng nhóm sản phẩm
-GROUP_COLORS = {
-    "Standard": "#FFCCCC",
-    "Deluxe": "#CCFFCC",
-    "Luxury": "#CCCCFF",
-    "Super Luxury": "#CCFCFF",
-}
-
-# Khởi tạo client Groq
-client = Groq(api_key=groq_api_key)
+# Cache Text2Img theo (prompt, sản phẩm, kích thước, tham số, seed, thứ tự biến thể); tra trong bộ nhớ
+txt2img_cache = ResultCache(Path(CACHE_DIR) / "txt2img_results.json",
+                            int(os.getenv('TXT2IMG_CACHE_MAX_MB', '300')) * 1024 * 1024, verify_files=False,
+                            owns_files=False)
+
+print(f"Loaded catalog: {len(PRODUCT_CATALOG)} products, "
+      f"{sum(1 for entry in PRODUCT_CATALOG.values() if entry['pretiled'])} pre-tiled textures")
+
+# Ảnh texture dùng cho sản phẩm (đã chọn lúc build index): bản tile sẵn nếu có, không thì ảnh gốc
+def texture_for_product(product_code):
+    entry = PRODUCT_CATALOG.get(product_code)
+    if not entry:
+        return None, False
+    return entry['texture'], entry['pretiled']
+
+# Hàng đợi job: tổng số job TensorArt chạy cùng lúc, độ sâu tối đa của hàng đợi
+# và số request được chờ cùng lúc của một session
+scheduler = FairScheduler(capacity=int(os.getenv('MAX_CONCURRENT_JOBS', '8')),
+                          max_queue=int(os.getenv('MAX_QUEUE_DEPTH', '30')),
+                          max_per_session=int(os.getenv('MAX_QUEUED_PER_SESSION', '2')))
+QUEUE_STATUS_INTERVAL = 1.0
+# Đại lý trả phí được ưu tiên: theo tên đăng nhập hoặc tham số ?dealer=<key> trên URL
+DEALER_USERS = set(filter(None, os.getenv('DEALER_USERS', '').split(',')))
+DEALER_KEYS = set(filter(None, os.getenv('DEALER_KEYS', '').split(',')))
 
 def rewrite_prompt_with_groq(vietnamese_prompt, product_codes):
     prompt = f"{vietnamese_prompt}, featuring {' and '.join(product_codes)} quartz marble"
     return prompt
 
+# Hàm chuẩn hoá ảnh đầu vào: xoay theo EXIF, chuyển RGB, thu nhỏ vừa đủ cho node 2
+# (768x1024, tối đa 2MP ở node 1) và mã hoá progressive JPEG trong bộ nhớ
+def normalize_input_image(image):
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    width, height = image.size
+    scale = min(1.0, max(INPUT_WIDTH / width, INPUT_HEIGHT / height),
+                (INPUT_MAX_MEGAPIXELS * 1_000_000 / (width * height)) ** 0.5)
+    if scale < 1.0:
+        image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=INPUT_JPEG_QUALITY, optimize=True, progressive=True)
+    print(f"Normalized input image {width}x{height} -> {image.size[0]}x{image.size[1]}, {buffer.tell()} bytes")
+    return buffer.getvalue()
+
 # Hàm upload ảnh lên TensorArt
 def upload_image_to_tensorart(image_path):
+    print(f"Starting upload for: {image_path}")
+    if not os.path.exists(image_path):
+        print(f"File does not exist: {image_path}")
+        return None
+    content_type = mimetypes.guess_type(image_path)[0] or 'image/jpeg'
+    with open(image_path, 'rb') as img_file:
+        return upload_image_bytes_to_tensorart(img_file.read(), image_path, content_type)
+
+# Hàm upload nội dung ảnh (bytes trong bộ nhớ) lên TensorArt
+def upload_image_bytes_to_tensorart(image_bytes, label="image", content_type='image/jpeg'):
     try:
-        url = f"{url_pre}/resource/image"
-        payload = json.dumps({"expireSec": "7200"})
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'Authorization': f'Bearer {api_key_token}'
-        }
-        print(f"Starting upload for: {image_path}")
-        if not os.path.exists(image_path):
-            print(f"File does not exist: {image_path}")
-            return None
-        response = requests.post(url, headers=headers, data=payload, timeout=30)
-        print(f"POST response: {response.status_code} - {response.text}")
-        response.raise_for_status()
+        payload = json.dumps({"expireSec": str(RESOURCE_EXPIRE_SEC)})
+        with span("upload_post", label=label):
+            response = tensorart.post("/resource/image", data=payload)
+            print(f"POST response: {response.status_code}" + (f" - {response.text}" if telemetry.DEBUG else ""))
+            response.raise_for_status()
         resource_response = response.json()
         
         put_url = resource_response.get('putUrl')
-        headers_put = resource_response.get('headers', {'Content-Type': 'image/jpeg'})
+        headers_put = dict(resource_response.get('headers') or {})
+        headers_put['Content-Type'] = content_type
         if not put_url:
             print(f"Upload failed - No 'putUrl' in response: {resource_response}")
             return None
         
-        print(f"Got putUrl: {put_url}")
-        with open(image_path, 'rb') as img_file:
-            upload_response = requests.put(put_url, data=img_file, headers=headers_put)
-            print(f"PUT response: {upload_response.status_code} - {upload_response.text}")
+        if telemetry.DEBUG:
+            print(f"Got putUrl: {put_url}")
+        # Gửi bytes trực tiếp để PUT có thể retry an toàn
+        with span("upload_put", label=label, bytes=len(image_bytes)):
+            upload_response = tensorart.put_presigned(put_url, image_bytes, headers_put)
+            print(f"PUT response: {upload_response.status_code}" + (f" - {upload_response.text}" if telemetry.DEBUG else ""))
             if upload_response.status_code not in [200, 203]:
                 raise Exception(f"PUT failed with status {upload_response.status_code}: {upload_response.text}")
-            if upload_response.status_code == 203:
-                print("Warning: PUT returned 203 - CallbackFailed, but proceeding with resourceId")
+        if upload_response.status_code == 203:
+            print("Warning: PUT returned 203 - CallbackFailed, but proceeding with resourceId")
         
         resource_id = resource_response.get('resourceId')
         if not resource_id:
             print(f"Upload failed - No 'resourceId' in response: {resource_response}")
             return None
+        # PUT 200/203 là đủ: resource chưa đồng bộ thì lần gửi job đầu tiên sẽ được gửi lại (run_workflow)
         print(f"Upload successful - resourceId: {resource_id}")
-        time.sleep(10)  # Đợi đồng bộ tài nguyên
-        print(f"Waited 10s for resource sync: {resource_id}")
         return resource_id
     except Exception as e:
-        print(f"Upload error for {image_path}: {str(e)}")
+        print(f"Upload error for {label}: {str(e)}")
         return None
 
 # Hàm kiểm tra params
 def check_workflow_params(params):
-    url = f"{url_pre}/jobs/workflow/params/check"
-    headers = {
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {api_key_token}'
-    }
     payload = json.dumps({"params": params})
-    print(f"Checking workflow params: {json.dumps(payload, indent=2)}")
-    response = requests.post(url, headers=headers, data=payload, timeout=30)
-    print(f"Params check response: {response.status_code} - {response.text}")
-    if response.status_code != 200:
-        raise Exception(f"Params check failed: {response.text}")
+    if telemetry.DEBUG:
+        print(f"Checking workflow params: {json.dumps(payload, indent=2)}")
+    with span("params_check"):
+        response = tensorart.post("/jobs/workflow/params/check", data=payload)
+        print(f"Params check response: {response.status_code}" + (f" - {response.text}" if telemetry.DEBUG else ""))
+        if response.status_code != 200:
+            raise Exception(f"Params check failed: {response.text}")
     return response.json()
 
-# Hàm chạy workflow và chờ kết quả
-def run_workflow(payload, step_name):
+# Webhook runningNotifyUrl: cần địa chỉ public của app để TensorArt gọi về
+callback_base_url = os.getenv('TENSORART_CALLBACK_URL', '')
+callback_secret = os.getenv('TENSORART_CALLBACK_SECRET') or secrets.token_urlsafe(16)
+# Khi có webhook, poll chỉ là dự phòng cho callback bị lỡ
+CALLBACK_FALLBACK_POLL_SEC = 15
+
+# Nhật ký job đã gửi (SQLite): request trùng sau khi khởi động lại gắn vào job cũ còn đang chạy
+job_journal = JobJournal(Path(CACHE_DIR) / "jobs.sqlite3")
+# Engine async gửi job và poll trạng thái cho mọi request trong một vòng lặp
+job_engine = JobEngine(tensorart, stats=readiness_stats,
+                       fallback_poll_interval=CALLBACK_FALLBACK_POLL_SEC if callback_base_url else None,
+                       journal=job_journal)
+
+# Cache resourceId của ảnh sản phẩm theo nội dung file, upload trước toàn bộ catalog
+texture_cache = ResourceCache(Path(CACHE_DIR) / "texture_resources.json", upload_image_to_tensorart)
+mask_resource_cache = ResourceCache(Path(CACHE_DIR) / "mask_resources.json", upload_image_to_tensorart)
+# Validate graph cục bộ; params check từ xa chỉ một lần cho mỗi cấu trúc template
+params_checker = ParamsChecker(check_workflow_params, Path(CACHE_DIR) / "params_checked.json")
+startup_profile.mark("config and caches")
+
+# Upload trước toàn bộ texture catalog ở thread nền, chỉ sau khi server đã nhận request
+# để không tranh CPU với lúc import/dựng UI; request tới sớm vẫn tự upload khi cần
+def start_warmup():
+    texture_cache.prewarm([texture_for_product(product_code)[0] for product_code in PRODUCT_CATALOG])
+
+# Trạng thái làm nóng hiển thị trên /readyz
+def warmup_status():
+    return {"textures": texture_cache.prewarm_status(), "jobs_in_flight": job_engine.in_flight()}
+
+# Phần mở rộng khi lưu từng loại ảnh kết quả của workflow (mặc định JPEG); mask lưu PNG để không nhoè biên
+OUTPUT_SUFFIXES = {"mask": ".png"}
+
+# Hàm chạy workflow qua job engine và chờ kết quả: điền slot vào template đã biên dịch.
+# job_key: key nội dung của kết quả; request giống hệt đang chạy dùng chung một job.
+# Trả về {tên output của template: đường dẫn file}
+async def run_workflow(template, slot_values, step_name, on_update=None, job_key=None):
+    params = template.render(**slot_values)
     try:
-        check_workflow_params(payload["params"])
+        await asyncio.to_thread(params_checker.check_template, template, params)
     except Exception as e:
         print(f"Workflow params check failed for {step_name}: {str(e)}")
         raise
-    
-    headers = {
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {api_key_token}'
-    }
-    print(f"Sending {step_name} workflow request to {url_pre}/jobs/workflow with data: {json.dumps(payload, indent=2)}")
-    response = requests.post(f"{url_pre}/jobs/workflow", json=payload, headers=headers, timeout=300)
-    print(f"{step_name} workflow response: {response.status_code} - {response.text}")
-    if response.status_code != 200:
-        raise Exception(f"Error {response.status_code}: {response.text}")
-    
-    response_data = response.json()
-    job_id = response_data['job'].get('id')
-    if not job_id:
-        raise Exception("Không tìm thấy job_id trong response")
-    
-    print(f"Starting {step_name} job status check for job_id: {job_id}")
-    max_attempts = 36
-    for attempt in range(max_attempts):
-        response = requests.get(f"{url_pre}/jobs/{job_id}", headers=headers, timeout=30)
-        response.raise_for_status()
-        result = response.json()
-        print(f"{step_name} job status (attempt {attempt + 1}/{max_attempts}): {json.dumps(result, indent=2)}")
-        status = result['job'].get('status')
-        if status == 'SUCCESS':
-            success_info = result['job'].get('successInfo', {})
-            if not success_info.get('images'):
-                raise Exception(f"Không tìm thấy hình ảnh trong successInfo cho {step_name}")
-            image_url = success_info['images'][0]['url']
-            image_response = requests.get(image_url)
-            image = Image.open(BytesIO(image_response.content))
-            # Chuyển từ RGBA sang RGB nếu cần
-            if image.mode == 'RGBA':
-                image = image.convert('RGB')
-            output_path = Path(SAVE_DIR) / f"{step_name}_{int(time.time())}.jpg"
-            image.save(output_path)
-            print(f"{step_name} image saved to: {output_path}")
-            return str(output_path)
-        elif status in ['FAILED', 'ERROR']:
-            failed_info = result['job'].get('failedInfo', {})
-            error_reason = failed_info.get('reason', 'Không có chi tiết')
-            error_code = failed_info.get('code', 'Không xác định')
-            raise Exception(f"{step_name} job thất bại: {error_reason} (code: {error_code})")
-        time.sleep(5)
-    raise Exception(f"Hết thời gian chờ {step_name} job sau 3 phút")
-
-# Hàm tạo mask và áp texture
-def generate_mask(image_resource_id, position, selected_product_code):
+
+    job = await submit_workflow(params, template, step_name, on_update, job_key)
+
+    success_info = job.get('successInfo', {})
+    images = success_info.get('images') or []
+    if not images:
+        raise Exception(f"Không tìm thấy hình ảnh trong successInfo cho {step_name}")
+    if len(images) < len(template.outputs):
+        print(f"{step_name} job returned {len(images)} image(s) for outputs {template.outputs}")
+    names = template.outputs[:len(images)]
+    contents = await asyncio.gather(*(job_engine.download(image['url']) for image in images[:len(names)]))
+    # Encode và ghi file trên thread nền
+    paths = await asyncio.gather(*(asyncio.wrap_future(image_store.save_download(content, OUTPUT_SUFFIXES.get(name, '.jpg')))
+                                   for name, content in zip(names, contents)))
+    outputs = dict(zip(names, paths))
+    print(f"{step_name} images saved to: {outputs}")
+    return outputs
+
+# Gửi workflow và chờ kết quả. Resource vừa upload có thể chưa đồng bộ: TensorArt báo không
+# tìm thấy resource thì gửi lại job theo backoff của "resource" thay vì probe trước mỗi lần gửi
+async def submit_workflow(params, template, step_name, on_update=None, job_key=None):
+    policy = POLICIES["resource"]
+    started = time.time()
+    attempts = 0
+    for delay in policy.delays():
+        attempts += 1
+        request_id = f"{step_name}_{uuid.uuid4().hex}"
+        payload = '{"requestId":%s,"params":%s,"runningNotifyUrl":%s}' % (
+            json.dumps(request_id), params, json.dumps(callback_url(callback_base_url, callback_secret)))
+        print(f"Sending {step_name} workflow request ({template.version}) to {url_pre}/jobs/workflow")
+        if telemetry.DEBUG:
+            print(f"{step_name} workflow payload: {payload}")
+        try:
+            job = await job_engine.run("/jobs/workflow", payload, "workflow_job", step_name, on_update, job_key)
+            if attempts > 1:
+                elapsed = time.time() - started
+                readiness_stats.record("resource", request_id, elapsed, attempts, True)
+                telemetry.record_span("readiness_wait", elapsed, kind="resource", name=step_name, attempts=attempts)
+            return job
+        except JobFailed as e:
+            error = Exception(f"{step_name} job thất bại: {e.reason} (code: {e.code})")
+        except JobTimeout:
+            raise Exception(f"Hết thời gian chờ {step_name} job sau 3 phút")
+        except Exception as e:
+            error = e
+        if not RESOURCE_NOT_READY.search(str(error)) or time.time() - started + delay > policy.timeout:
+            raise error
+        print(f"{step_name}: resource not synced yet ({str(error)}), retrying in {delay:.1f}s")
+        metrics.inc('tensorart_retries_total', source='resource_sync')
+        await asyncio.sleep(delay)
+
+def normalize_position(position):
+    if isinstance(position, (set, list)):
+        position = list(position)[0] if position else "default"
+    return position
+
+def surface_mask_key(image_digest, position):
+    position = normalize_position(position)
+    return make_key(image_digest, position, workflow_templates.get("mask", position).version)
+
+# Hàm tách mask bề mặt cho (ảnh, vị trí); mask được lưu lại (PNG) và upload thành resource dùng lại
+async def generate_surface_mask(image_resource_id, image_digest, position, on_update=None):
+    position = normalize_position(position)
+    template = workflow_templates.get("mask", position)
+    key = surface_mask_key(image_digest, position)
+    mask_path = mask_cache.get(key)
+    if not mask_path:
+        try:
+            outputs = await run_workflow(template, {"image": image_resource_id, "prompt": position.lower()},
+                                         "mask", on_update, key)
+            mask_path = outputs["mask"]
+        except Exception as e:
+            print(f"Surface mask error: {str(e)}")
+            return None
+        mask_cache.put(key, mask_path)
+    else:
+        image_store.touch(mask_path)
+        print(f"Reusing surface mask {mask_path} for position {position}")
+    mask_resource_id, _ = await asyncio.to_thread(mask_resource_cache.get, mask_path)
+    return mask_resource_id
+
+# Hàm áp texture theo mask (dùng mask có sẵn nếu được truyền vào). Graph đầy đủ xuất kèm mask:
+# mask được lưu theo image_digest để lần đổi sản phẩm sau trên cùng ảnh chỉ cần graph dán
+async def generate_mask(image_resource_id, position, selected_product_code, mask_resource_id=None, on_update=None,
+                        job_key=None, image_digest=None):
     try:
         if not image_resource_id:
             raise Exception("Không có image_resource_id hợp lệ - ảnh gốc chưa được upload")
         print(f"Using image_resource_id: {image_resource_id}")
-        time.sleep(10)  # Đợi đồng bộ tài nguyên
-        
+
         short_code = selected_product_code.split()[0]
-        texture_filepath = PRODUCT_IMAGE_MAP.get(selected_product_code)
-        print(f"Texture file: {texture_filepath}, exists: {os.path.exists(texture_filepath)}")
-        if not texture_filepath or not os.path.exists(texture_filepath):
+        texture_filepath, pretiled = texture_for_product(selected_product_code)
+        print(f"Texture file: {texture_filepath} (pre-tiled: {pretiled})")
+        if not texture_filepath:
             raise Exception(f"Không tìm thấy ảnh sản phẩm cho mã {short_code}")
         
-        texture_resource_id = upload_image_to_tensorart(texture_filepath)
-        print(f"Texture resource_id: {texture_resource_id}")
+        texture_resource_id, from_cache = await asyncio.to_thread(texture_cache.get, texture_filepath)
+        print(f"Texture resource_id: {texture_resource_id} (cached: {from_cache})")
         if not texture_resource_id:
             raise Exception(f"Không thể upload ảnh sản phẩm {short_code}")
-        time.sleep(10)  # Đợi đồng bộ tài nguyên
 
-        if isinstance(position, (set, list)):
-            position = position[0] if position else "default"
+        position = normalize_position(position)
         print(f"Position: {position}, type: {type(position)}")
 
-        # Dùng params đúng như mẫu TensorArt
-        workflow_params = {
-            "1": {
-                "classType": "LayerMask: SegmentAnythingUltra V3",
-                "inputs": {
-                    "black_point": 0.3,
-                    "detail_dilate": 6,
-                    "detail_erode": 65,
-                    "detail_method": "GuidedFilter",
-                    "device": "cuda",
-                    "image": ["2", 0],
-                    "max_megapixels": 2,
-                    "process_detail": True,
-                    "prompt": ["4", 0],
-                    "sam_models": ["3", 0],
-                    "threshold": 0.3,
-                    "white_point": 0.99
-                },
-                "properties": {"Node name for S&R": "LayerMask: SegmentAnythingUltra V3"}
-            },
-            "10": {
-                "classType": "Image Seamless Texture",
-                "inputs": {
-                    "blending": 0.37,
-                    "images": ["17", 0],
-                    "tiled": "true",
-                    "tiles": 2
-                },
-                "properties": {"Node name for S&R": "Image Seamless Texture"}
-            },
-            "13": {
-                "classType": "Paste By Mask",
-                "inputs": {
-                    "image_base": ["2", 0],
-                    "image_to_paste": ["10", 0],
-                    "mask": ["8", 0],
-                    "resize_behavior": "resize"
-                },
-                "properties": {"Node name for S&R": "Paste By Mask"}
-            },
-            "17": {
-                "classType": "TensorArt_LoadImage",
-                "inputs": {
-                    "_height": 768,
-                    "_width": 512,
-                    "image": texture_resource_id,
-                    "upload": "image"
-                },
-                "properties": {"Node name for S&R": "TensorArt_LoadImage"}
-            },
-            "2": {
-                "classType": "TensorArt_LoadImage",
-                "inputs": {
-                    "_height": 1024,
-                    "_width": 768,
-                    "image": image_resource_id,
-                    "upload": "image"
-                },
-                "properties": {"Node name for S&R": "TensorArt_LoadImage"}
-            },
-            "3": {
-                "classType": "LayerMask: LoadSegmentAnythingModels",
-                "inputs": {
-                    "grounding_dino_model": "GroundingDINO_SwinB (938MB)",
-                    "sam_model": "sam_vit_h (2.56GB)"
-                },
-                "properties": {"Node name for S&R": "LayerMask: LoadSegmentAnythingModels"}
-            },
-            "4": {
-                "classType": "TensorArt_PromptText",
-                "inputs": {"Text": position.lower()},
-                "properties": {"Node name for S&R": "TensorArt_PromptText"}
-            },
-            "7": {
-                "classType": "PreviewImage",
-                "inputs": {"images": ["13", 0]},
-                "properties": {"Node name for S&R": "PreviewImage"}
-            },
-            "8": {
-                "classType": "MaskToImage",
-                "inputs": {"mask": ["1", 1]},
-                "properties": {"Node name for S&R": "MaskToImage"}
-            }
-        }
-
-        payload = {
-            "requestId": f"workflow_{int(time.time())}",
-            "params": workflow_params,
-            "runningNotifyUrl": ""
-        }
-        
-        output_path = run_workflow(payload, "full_workflow")
-        return output_path
+        slot_values = {"image": image_resource_id, "texture": texture_resource_id}
+        if mask_resource_id:
+            # Đã có mask cho ảnh + vị trí này: bỏ qua SegmentAnything, chỉ tile texture và dán theo mask
+            slot_values["mask"] = mask_resource_id
+            template_name, step_name = "paste", "paste_texture"
+        else:
+            slot_values["prompt"] = position.lower()
+            template_name, step_name = "full", "full_workflow"
+        # Texture đã tile sẵn offline: dùng biến thể không có node Seamless Texture
+        if pretiled:
+            template_name += "_pretiled"
+
+        template = workflow_templates.get(template_name, position)
+        outputs = await run_workflow(template, slot_values, step_name, on_update, job_key)
+        if outputs.get("mask") and image_digest:
+            mask_cache.put(surface_mask_key(image_digest, position), outputs["mask"])
+            # Upload mask ở nền để lần sau không phải chờ
+            mask_resource_cache.prewarm([outputs["mask"]])
+        return outputs["result"]
 
     except Exception as e:
         print(f"Mask generation error: {str(e)}")
         return None
 
+def progress_html(percent, label=""):
+    label_html = f'<div class="progress-label">{label}</div>' if label else ''
+    return f'{label_html}<div class="progress-container"><div class="progress-bar" style="width: {percent}%"></div></div>'
+
+# Phần trăm tiến độ TensorArt tự báo (nếu có), quy về 0-100
+def reported_percent(job):
+    for info in (job.get('runningInfo'), job.get('processingInfo'), job):
+        if not isinstance(info, dict):
+            continue
+        # 'progress' là tỉ lệ 0-1, 'percentage'/'percent' đã là 0-100
+        for field, scale in (('progress', 100), ('percentage', 1), ('percent', 1)):
+            if info.get(field) is not None:
+                try:
+                    value = float(info[field]) * scale
+                except (TypeError, ValueError):
+                    continue
+                return int(min(100, max(0, value)))
+    return None
+
+# Tiến độ một job TensorArt từ trạng thái thật: (phần trăm 0-100, mô tả).
+# Khi API không báo phần trăm thì ước tính theo thời gian điển hình đã đo được của loại job.
+def job_progress(job, kind, started):
+    status = job.get('status')
+    if status == 'SUCCESS':
+        return 95, "đang tải ảnh kết quả"
+    if status == 'RUNNING':
+        percent = reported_percent(job)
+        typical = readiness_stats.typical(kind)
+        if percent is None and typical:
+            percent = min(90, int(100 * (time.time() - started) / typical))
+            return max(percent, 10), f"đang chạy (~{percent}%)"
+        if percent is None:
+            return 10, "đang chạy"
+        return max(10, int(percent * 0.9)), f"đang chạy {percent}%"
+    if status in NON_TERMINAL_STATUSES:
+        waiting = job.get('waitingInfo') or {}
+        rank, length = waiting.get('queueRank'), waiting.get('queueLen')
+        if rank and length:
+            return 5, f"đang xếp hàng trên TensorArt ({rank}/{length})"
+        return 5, "đang xếp hàng trên TensorArt"
+    return 0, "đang gửi"
+
+# Chờ các task; phát None mỗi khi có cập nhật trạng thái job trong updates, hoặc task vừa xong
+async def iterate_with_updates(tasks, updates):
+    pending = set(tasks)
+    while pending:
+        waiter = asyncio.ensure_future(updates.get())
+        done, _ = await asyncio.wait(pending | {waiter}, return_when=asyncio.FIRST_COMPLETED)
+        if waiter in done:
+            # Gộp các cập nhật đến dồn dập thành một lần vẽ lại
+            while not updates.empty():
+                updates.get_nowait()
+            yield None
+        else:
+            waiter.cancel()
+        for task in done - {waiter}:
+            pending.discard(task)
+            yield task
+
+def format_wait(seconds):
+    if seconds < 60:
+        return "dưới 1 phút"
+    return f"khoảng {round(seconds / 60)} phút"
+
+def priority_for_request(request):
+    if request is None:
+        return PRIORITY_NORMAL
+    if request.username and request.username in DEALER_USERS:
+        return PRIORITY_HIGH
+    if request.query_params.get('dealer') in DEALER_KEYS:
+        return PRIORITY_HIGH
+    return PRIORITY_NORMAL
+
+# Xếp request vào scheduler; None nếu hàng đợi đã đầy
+def enqueue_request(request, weight):
+    session = (request.session_hash if request else None) or "anonymous"
+    try:
+        ticket = scheduler.enqueue(session, priority_for_request(request), weight)
+    except QueueFull as e:
+        print(f"Rejected request from {session}: {str(e)} - {scheduler.stats()}")
+        return None
+    print(f"Queued request from {session} (weight {weight}) - {scheduler.stats()}")
+    return ticket
+
+# Vừa chờ tới lượt vừa báo vị trí thật trong hàng đợi và thời gian chờ ước tính
+async def queue_updates(ticket, image_value=None):
+    first_position = None
+    started = time.perf_counter()
+    while not ticket.granted:
+        position, eta = scheduler.position(ticket)
+        if first_position is None:
+            first_position = position + 1
+        percent = int(100 * (first_position - position - 1) / first_position)
+        label = f"Vị trí trong hàng đợi: {position + 1} - thời gian chờ {format_wait(eta)}"
+        yield f"Đang chờ tới lượt (vị trí {position + 1})...", gr.update(visible=True), gr.update(visible=True, value=progress_html(percent, label)), image_value
+        await ticket.wait(QUEUE_STATUS_INTERVAL)
+    telemetry.record_span("scheduler_wait", time.perf_counter() - started)
+
+QUEUE_FULL_MESSAGE = "Hệ thống đang quá tải, vui lòng thử lại sau ít phút."
+
+# Hash nội dung ảnh gốc (đọc toàn bộ pixel) - gọi qua asyncio.to_thread để không chặn event loop
+def input_image_digest(image):
+    return hashlib.sha256(f"{image.mode}:{image.size}".encode() + image.tobytes()).hexdigest()
+
 # Hàm xử lý img2img với spinner và progress bar
-def generate_img2img(image, position, size_choice, custom_size, *product_choices):
+async def generate_img2img(request: gr.Request, image, position, size_choice, custom_size, force_regenerate, *product_choices):
+    telemetry.new_trace()
     yield None, gr.update(visible=True), gr.update(visible=True, value='<div class="progress-container"><div class="progress-bar" style="width: 0%"></div></div>'), None
     
     if size_choice == "Custom size":
@@ -367,35 +510,145 @@ def generate_img2img(image, position, size_choice, custom_size, *product_choices
     else:
         width, height = map(int, size_choice.split("x"))
 
-    yield "Đang upload ảnh gốc...", gr.update(visible=True), gr.update(visible=True, value='<div class="progress-container"><div class="progress-bar" style="width: 20%"></div></div>'), None
-    image_path = Path(SAVE_DIR) / f"input_{int(time.time())}.jpg"
-    image.save(image_path)
-    image_resource_id = upload_image_to_tensorart(str(image_path))
-    print(f"Generated image_resource_id: {image_resource_id}")
-    if not image_resource_id:
-        yield "Lỗi: Không thể upload ảnh gốc", gr.update(visible=False), gr.update(visible=False), None
+    if image is None:
+        yield "Vui lòng tải lên ảnh.", gr.update(visible=False), gr.update(visible=False), None
         return
-
-    yield "Đang chuẩn bị ảnh sản phẩm...", gr.update(visible=True), gr.update(visible=True, value='<div class="progress-container"><div class="progress-bar" style="width: 40%"></div></div>'), None
     selected_products = []
-    for group, choices in zip(PRODUCT_GROUPS.keys(), product_choices):
+    for group, choices in zip(IMG2IMG_PRODUCT_GROUPS.keys(), product_choices):
         selected_products.extend(choices)
     if not selected_products:
         yield "Vui lòng chọn ít nhất một mã sản phẩm.", gr.update(visible=False), gr.update(visible=False), None
         return
-    selected_product_code = selected_products[0]
 
-    yield "Đang tạo mask và áp texture...", gr.update(visible=True), gr.update(visible=True, value='<div class="progress-container"><div class="progress-bar" style="width: 60%"></div></div>'), None
-    output_path = generate_mask(image_resource_id, position, selected_product_code)
-    if not output_path:
+    # Sản phẩm đã có kết quả cho đúng ảnh + vị trí này thì trả về ngay
+    image_digest = await asyncio.to_thread(input_image_digest, image)
+    gallery = []
+    cache_keys = {}
+    pending_products = []
+    for product_code in selected_products:
+        cache_keys[product_code] = make_key(image_digest, str(position), product_code,
+                                            workflow_templates.version_key(position, IMG2IMG_TEMPLATES),
+                                            texture_for_product(product_code)[0])
+        cached_path = None if force_regenerate else result_cache.get(cache_keys[product_code])
+        if cached_path:
+            image_store.touch(cached_path)
+            gallery.append((cached_path, product_code))
+        else:
+            pending_products.append(product_code)
+    print(f"Result cache: {len(gallery)} hit(s), {len(pending_products)} to generate - {result_cache.stats()}")
+    if not pending_products:
+        yield "Hoàn tất! (kết quả có sẵn)", gr.update(visible=False), gr.update(visible=True, value='<div class="progress-container"><div class="progress-bar" style="width: 100%"></div></div>'), gallery
+        return
+
+    ticket = enqueue_request(request, min(len(pending_products), MAX_PARALLEL_PRODUCTS))
+    if ticket is None:
+        yield QUEUE_FULL_MESSAGE, gr.update(visible=False), gr.update(visible=False), gallery or None
+        return
+    try:
+        async for update in queue_updates(ticket, list(gallery)):
+            yield update
+        async for update in img2img_pipeline(image, image_digest, position, pending_products, cache_keys, gallery):
+            yield update
+    finally:
+        scheduler.release(ticket)
+
+# Upload ảnh gốc đang chạy theo hash nội dung: request trùng (bấm hai lần, trình duyệt kết nối lại)
+# chờ chung một lần upload
+pending_uploads = {}
+
+async def upload_input_image(image, image_digest):
+    task = pending_uploads.get(image_digest)
+    if task is None:
+        async def upload():
+            image_bytes = await asyncio.to_thread(normalize_input_image, image)
+            return await asyncio.to_thread(upload_image_bytes_to_tensorart, image_bytes, "input image")
+        task = pending_uploads[image_digest] = asyncio.ensure_future(upload())
+        task.add_done_callback(lambda _: pending_uploads.pop(image_digest, None))
+    else:
+        print(f"Input image {image_digest[:12]} is already uploading, waiting for it")
+    return await asyncio.shield(task)
+
+# Phần nặng của img2img (chạy khi đã tới lượt): upload ảnh, tách mask, áp texture song song
+async def img2img_pipeline(image, image_digest, position, pending_products, cache_keys, gallery):
+    yield "Đang upload ảnh gốc...", gr.update(visible=True), gr.update(visible=True, value=progress_html(0, "Đang upload ảnh gốc")), list(gallery)
+    image_resource_id = await upload_input_image(image, image_digest)
+    print(f"Generated image_resource_id: {image_resource_id}")
+    if not image_resource_id:
+        yield "Lỗi: Không thể upload ảnh gốc", gr.update(visible=False), gr.update(visible=False), None
+        return
+
+    # Mỗi lần job TensorArt đổi trạng thái (poll hoặc webhook) thì cập nhật UI
+    updates = asyncio.Queue()
+    states = {}
+
+    def tracker(name):
+        started = time.time()
+        states[name] = (0, "đang chờ")
+
+        def on_update(job):
+            states[name] = job_progress(job, "workflow_job", started)
+            updates.put_nowait(None)
+        return on_update
+
+    # Tách mask một lần cho cả ảnh khi nó đã có sẵn hoặc được dùng cho nhiều sản phẩm.
+    # Một sản phẩm với ảnh mới thì chạy thẳng graph đầy đủ, không thêm một job nối tiếp;
+    # graph đó xuất kèm mask nên lần đổi sản phẩm sau trên cùng ảnh chỉ cần graph dán.
+    # Lỗi tách mask thì mỗi sản phẩm chạy graph đầy đủ như cũ.
+    mask_resource_id = None
+    if len(pending_products) > 1 or mask_cache.get(surface_mask_key(image_digest, position)):
+        mask_task = asyncio.create_task(generate_surface_mask(image_resource_id, image_digest, position, tracker("mask")))
+        try:
+            async for finished in iterate_with_updates([mask_task], updates):
+                percent, text = states["mask"]
+                yield "Đang tách vùng bề mặt...", gr.update(visible=True), gr.update(visible=True, value=progress_html(10 + percent * 20 // 100, f"Mask: {text}")), list(gallery)
+        finally:
+            mask_task.cancel()
+        mask_resource_id = mask_task.result()
+        print(f"Surface mask resource_id: {mask_resource_id}")
+
+    # Chạy song song mỗi sản phẩm một workflow, giới hạn số job cùng lúc
+    semaphore = asyncio.Semaphore(MAX_PARALLEL_PRODUCTS)
+
+    async def render(product_code, on_update):
+        async with semaphore:
+            states[product_code] = (0, "đang gửi")
+            updates.put_nowait(None)
+            return product_code, await generate_mask(image_resource_id, position, product_code, mask_resource_id,
+                                                     on_update, cache_keys[product_code], image_digest)
+
+    tasks = [asyncio.create_task(render(product_code, tracker(product_code))) for product_code in pending_products]
+    failed = []
+    done_count = 0
+    try:
+        async for finished in iterate_with_updates(tasks, updates):
+            if finished is not None:
+                product_code, output_path = finished.result()
+                if output_path:
+                    result_cache.put(cache_keys[product_code], output_path)
+                    gallery.append((output_path, product_code))
+                else:
+                    failed.append(product_code.split()[0])
+                states[product_code] = (100, "xong" if output_path else "lỗi")
+                done_count += 1
+            progress = 30 + 70 * sum(states[code][0] for code in pending_products) // (100 * len(tasks))
+            label = "<br>".join(f"{code.split()[0]}: {states[code][1]}" for code in pending_products)
+            yield f"Đã xong {done_count}/{len(tasks)} sản phẩm...", gr.update(visible=True), gr.update(visible=True, value=progress_html(progress, label)), list(gallery)
+    finally:
+        # Người dùng đóng trang giữa chừng thì huỷ các job còn lại
+        for task in tasks:
+            task.cancel()
+
+    if not gallery:
         yield "Lỗi: Không thể tạo ảnh", gr.update(visible=False), gr.update(visible=False), None
         return
-    
-    yield "Hoàn tất!", gr.update(visible=False), gr.update(visible=True, value='<div class="progress-container"><div class="progress-bar" style="width: 100%"></div></div>'), Image.open(output_path)
+    message = "Hoàn tất!" if not failed else f"Hoàn tất! Không thể tạo ảnh cho: {', '.join(failed)}"
+    yield message, gr.update(visible=False), gr.update(visible=True, value='<div class="progress-container"><div class="progress-bar" style="width: 100%"></div></div>'), gallery
 
 # Hàm generate_with_loading (text2img)
-def generate_with_loading(prompt, size_choice, custom_size, *product_choices):
+async def generate_with_loading(request: gr.Request, prompt, size_choice, custom_size, batch_count, seed, reuse_results, *product_choices):
+    telemetry.new_trace()
     yield None, gr.update(visible=True), gr.update(visible=True, value='<div class="progress-container"><div class="progress-bar" style="width: 0%"></div></div>'), None
+    ticket = None
     try:
         if size_choice == "Custom size":
             if not custom_size.strip():
@@ -406,39 +659,83 @@ def generate_with_loading(prompt, size_choice, custom_size, *product_choices):
             width, height = map(int, size_choice.split("x"))
 
         selected_products = []
-        for group, choices in zip(PRODUCT_GROUPS.keys(), product_choices):
+        for group, choices in zip(TXT2IMG_PRODUCT_GROUPS.keys(), product_choices):
             selected_products.extend(choices)
         if not selected_products:
             yield "Vui lòng chọn ít nhất một mã sản phẩm.", gr.update(visible=False), gr.update(visible=False), None
             return
 
+        count = max(1, min(int(batch_count or 1), MAX_TXT2IMG_BATCH))
+        seed = int(seed) if seed is not None and seed >= 0 else -1
+
         short_codes = [code.split()[0] for code in selected_products]
+
+        # Chỉ dùng cache khi seed cố định (kết quả tái tạo được) hoặc người dùng chủ động chọn
+        cache_keys = [make_key(prompt, sorted(short_codes), width, height, TXT2IMG_SETTINGS, seed, index)
+                      for index in range(count)]
+        if seed >= 0 or reuse_results:
+            cached_paths = [txt2img_cache.get(key) for key in cache_keys]
+            print(f"Text2Img cache: {sum(1 for path in cached_paths if path)}/{count} hit(s) - {txt2img_cache.stats()}")
+            if all(path and image_store.touch(path) for path in cached_paths):
+                yield None, gr.update(visible=False), gr.update(visible=False), [
+                    (path, f"Seed {seed + index}" if seed >= 0 else f"Biến thể {index + 1}")
+                    for index, path in enumerate(cached_paths)]
+                return
+
         rewritten_prompt = rewrite_prompt_with_groq(prompt, short_codes)
         print(f"Rewritten Prompt: {rewritten_prompt}")
 
-        progress = 0
-        while progress < 100:
-            time.sleep(0.5)
-            progress += 10
-            yield None, gr.update(visible=True), gr.update(value=f'<div class="progress-container"><div class="progress-bar" style="width: {progress}%"></div></div>'), None
-
-        result = txt2img(rewritten_prompt, width, height, short_codes)
+        ticket = enqueue_request(request, 1)
+        if ticket is None:
+            yield QUEUE_FULL_MESSAGE, gr.update(visible=False), gr.update(visible=False), None
+            return
+        async for update in queue_updates(ticket):
+            yield update
+
+        # Tiến độ lấy từ trạng thái job thật trên TensorArt
+        updates = asyncio.Queue()
+        started = time.time()
+        state = {'job': {}}
+
+        def on_update(job):
+            state['job'] = job
+            updates.put_nowait(None)
+
+        # Chỉ lưu đĩa khi kết quả có thể được dùng lại; còn lại trả thẳng từ bộ nhớ
+        persist = seed >= 0 or reuse_results
+        # Request giống hệt đang chạy thì dùng chung job; seed ngẫu nhiên chỉ gộp trong cùng session
+        session = None if seed >= 0 else (request.session_hash if request else None) or "anonymous"
+        job_key = make_key("txt2img", rewritten_prompt, sorted(short_codes), width, height, TXT2IMG_SETTINGS,
+                           seed, count, session)
+        task = asyncio.create_task(txt2img(rewritten_prompt, width, height, short_codes, count, seed, on_update, persist,
+                                           job_key))
+        try:
+            async for finished in iterate_with_updates([task], updates):
+                percent, text = job_progress(state['job'], "txt2img_job", started)
+                yield None, gr.update(visible=True), gr.update(visible=True, value=progress_html(percent, f"Text2Img ({count} ảnh): {text}")), None
+        finally:
+            task.cancel()
+        result = task.result()
         if isinstance(result, str):
             yield result, gr.update(visible=False), gr.update(visible=False), None
         else:
+            if persist:
+                for key, (save_path, caption) in zip(cache_keys, result):
+                    txt2img_cache.put(key, save_path)
             yield None, gr.update(visible=False), gr.update(visible=False), result
     except Exception as e:
         yield f"Lỗi khi xử lý: {e}", gr.update(visible=False), gr.update(visible=False), None
+    finally:
+        if ticket:
+            scheduler.release(ticket)
 
-# Hàm text2img
-def txt2img(prompt, width, height, product_codes):
-    model_id = "779398605850080514"
-    vae_id = "ae.sft"
-
+# Hàm text2img: một job sinh count biến thể; seed >= 0 để tái tạo đúng các biến thể đó.
+# Trả về danh sách (đường dẫn ảnh hoặc ảnh PIL nếu persist=False, chú thích seed) hoặc chuỗi lỗi.
+async def txt2img(prompt, width, height, product_codes, count=1, seed=-1, on_update=None, persist=True, job_key=None):
     txt2img_data = {
-        "request_id": hashlib.md5(str(int(time.time())).encode()).hexdigest(),
+        "request_id": uuid.uuid4().hex,
         "stages": [
-            {"type": "INPUT_INITIALIZE", "inputInitialize": {"seed": -1, "count": 1}},
+            {"type": "INPUT_INITIALIZE", "inputInitialize": {"seed": seed, "count": count}},
             {
                 "type": "DIFFUSION",
                 "diffusion": {
@@ -446,56 +743,74 @@ def txt2img(prompt, width, height, product_codes):
                     "height": height,
                     "prompts": [{"text": prompt}],
                     "negativePrompts": [{"text": " "}],
-                    "sdModel": model_id,
-                    "sdVae": vae_id,
-                    "sampler": "Euler a",
-                    "steps": 30,
-                    "cfgScale": 8,
-                    "clipSkip": 1,
-                    "etaNoiseSeedDelta": 31337,
+                    **TXT2IMG_SETTINGS,
                 }
             }
-        ]
-    }
-    headers = {
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {api_key_token}'
+        ],
+        "runningNotifyUrl": callback_url(callback_base_url, callback_secret)
     }
-    response = requests.post(f"{url_pre}/jobs", json=txt2img_data, headers=headers)
-    if response.status_code != 200:
-        return f"Error: {response.status_code} - {response.text}"
-    response_data = response.json()
-    job_id = response_data['job']['id']
-    print(f"Job created. ID: {job_id}")
-    start_time = time.time()
-    timeout = 300
-    while True:
-        time.sleep(10)
-        elapsed_time = time.time() - start_time
-        if elapsed_time > timeout:
-            return f"Error: Job timed out after {timeout} seconds."
-        response = requests.get(f"{url_pre}/jobs/{job_id}", headers=headers)
-        if response.status_code != 200:
-            return f"Error: {response.status_code} - {response.text}"
-        get_job_response_data = response.json()
-        job_status = get_job_response_data['job']['status']
-        if job_status == 'SUCCESS':
-            image_url = get_job_response_data['job']['successInfo']['images'][0]['url']
-            response_image = requests.get(image_url)
-            img = Image.open(BytesIO(response_image.content))
-            save_path = Path(SAVE_DIR) / f"{hashlib.md5(prompt.encode()).hexdigest()}.png"
-            img.save(save_path)
-            print(f"Image saved to: {save_path}")
-            return img
-        elif job_status == 'FAILED':
-            return "Error: Job failed."
+    try:
+        job = await job_engine.run("/jobs", txt2img_data, "txt2img_job", "txt2img", on_update, job_key)
+    except JobFailed:
+        return "Error: Job failed."
+    except JobTimeout:
+        return f"Error: Job timed out after {int(POLICIES['txt2img_job'].timeout)} seconds."
+    except Exception as e:
+        return f"Error: {str(e)}"
+    images = job.get('successInfo', {}).get('images') or []
+    if not images:
+        return "Error: No images returned."
+    # Tải tất cả ảnh của batch song song
+    contents = await asyncio.gather(*(job_engine.download(image['url']) for image in images))
+    if persist:
+        outputs = await asyncio.gather(*(asyncio.wrap_future(image_store.save_download(content, '.png'))
+                                         for content in contents))
+        print(f"Images saved to: {outputs} - {image_store.stats()}")
+    else:
+        outputs = [Image.open(BytesIO(content)) for content in contents]
+    results = []
+    for index, (image, output) in enumerate(zip(images, outputs)):
+        image_seed = image.get('seed', seed + index if seed >= 0 else None)
+        results.append((output, f"Seed {image_seed}" if image_seed is not None else f"Biến thể {index + 1}"))
+    return results
+
+# Số liệu đọc lúc scrape /metrics từ các cache, kho ảnh, scheduler và job engine
+def collect_metrics():
+    samples = []
+    for name, cache in (("img2img_result", result_cache), ("surface_mask", mask_cache), ("txt2img", txt2img_cache)):
+        stats = cache.stats()
+        samples.append(("tensorart_cache_hits_total", "counter", {"cache": name}, stats['hits']))
+        samples.append(("tensorart_cache_misses_total", "counter", {"cache": name}, stats['misses']))
+        samples.append(("tensorart_cache_entries", "gauge", {"cache": name}, stats['entries']))
+    params_stats = params_checker.stats()
+    samples.append(("tensorart_cache_hits_total", "counter", {"cache": "params_check"}, params_stats['skipped']))
+    samples.append(("tensorart_cache_misses_total", "counter", {"cache": "params_check"}, params_stats['remote_checks']))
+    store_stats = image_store.stats()
+    samples.append(("tensorart_image_store_files", "gauge", {}, store_stats['files']))
+    samples.append(("tensorart_image_store_bytes", "gauge", {}, store_stats['bytes']))
+    samples.append(("tensorart_image_store_evicted_total", "counter", {}, store_stats['evicted']))
+    queue_stats = scheduler.stats()
+    samples.append(("tensorart_scheduler_in_use", "gauge", {}, queue_stats['in_use']))
+    samples.append(("tensorart_scheduler_queued", "gauge", {}, queue_stats['queued']))
+    samples.append(("tensorart_scheduler_rejected_total", "counter", {}, queue_stats['rejected']))
+    samples.append(("tensorart_jobs_in_flight", "gauge", {}, job_engine.in_flight()))
+    return samples
+
+metrics.register_collector(collect_metrics)
+
+# Ảnh xem trước của một nhóm sản phẩm: thumbnail WebP nhỏ trong index thay vì ảnh gốc nhiều MB
+# (mã chưa có ảnh thì không có thumbnail)
+def product_thumbnails(labels):
+    return gr.Gallery(value=[(CATALOG_ENTRIES[label]['thumbnail'], label) for label in labels
+                             if CATALOG_ENTRIES[label].get('thumbnail')],
+                      columns=6, height="auto", show_label=False, allow_preview=False, interactive=False)
 
 # CSS
 css = """
 .loading-spinner { border: 4px solid #f3f3f3; border-top: 4px solid #3498db; border-radius: 50%; width: 40px; height: 40px; animation: spin 1s linear infinite; margin: auto; }
 @keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
 .progress-container { width: 100%; max-width: 400px; margin: 20px auto; background-color: #f3f3f3; border-radius: 20px; overflow: hidden; box-shadow: 0 2px 5px rgba(0, 0, 0, 0.1); }
+.progress-label { text-align: center; font-size: 0.9em; color: #555; margin-top: 10px; }
 .progress-bar { width: 0%; height: 10px; background: linear-gradient(90deg, #3498db, #e74c3c); border-radius: 20px; transition: width 0.3s ease-in-out; }
 """
 
@@ -510,22 +825,26 @@ with gr.Blocks(css=css) as demo:
                     size_radio = gr.Radio(choices=["1152x768", "1024x1024", "768x1152", "Custom size"], label="Chọn kích thước ảnh", value="1024x1024")
                     custom_size_input = gr.Textbox(label="Nhập kích thước tùy chỉnh (VD: 1280x720)", placeholder="Chiều rộng x Chiều cao", visible=False)
                     size_radio.change(fn=lambda x: gr.update(visible=x == "Custom size"), inputs=size_radio, outputs=custom_size_input)
+                    batch_count_input = gr.Slider(label="Số biến thể", minimum=1, maximum=MAX_TXT2IMG_BATCH, step=1, value=1)
+                    seed_input = gr.Number(label="Seed (-1 = ngẫu nhiên, cố định để tạo lại đúng biến thể)", value=-1, precision=0)
+                    reuse_results_input = gr.Checkbox(label="Dùng lại kết quả đã lưu cho cùng mô tả (kể cả seed ngẫu nhiên)", value=False)
                     product_checkbox_group = []
-                    for group, color in GROUP_COLORS.items():
+                    for group, labels in TXT2IMG_PRODUCT_GROUPS.items():
                         with gr.Accordion(f"Sản phẩm - {group}", open=False):
+                            product_thumbnails(labels)
                             checkboxes = gr.CheckboxGroup(
-                                choices=[(code, code) for code in PRODUCT_GROUPS[group] if PRODUCT_GROUPS[group][code] not in ["is coming", "is loading"]],
+                                choices=[(label, label) for label in labels],
                                 label=f"Chọn sản phẩm ({group})",
                                 value=[]
                             )
                             product_checkbox_group.append((group, checkboxes))
                     generate_button = gr.Button("Generate")
                 with gr.Column():
-                    output_image = gr.Image(label="Ảnh đã tạo")
+                    output_image = gr.Gallery(label="Ảnh đã tạo", columns=2)
                     error_message = gr.Textbox(label="Thông báo", visible=False)
                     loading_spinner = gr.HTML('<div class="loading-spinner"></div>', visible=False)
                     progress_bar = gr.HTML('', visible=False)
-            inputs = [prompt_input, size_radio, custom_size_input] + [checkboxes for _, checkboxes in product_checkbox_group]
+            inputs = [prompt_input, size_radio, custom_size_input, batch_count_input, seed_input, reuse_results_input] + [checkboxes for _, checkboxes in product_checkbox_group]
             generate_button.click(fn=generate_with_loading, inputs=inputs, outputs=[error_message, loading_spinner, progress_bar, output_image])
 
         with gr.Tab("Img2Img"):
@@ -533,25 +852,56 @@ with gr.Blocks(css=css) as demo:
                 with gr.Column():
                     image_upload = gr.Image(label="Tải lên ảnh", type="pil")
                     position_input = gr.Dropdown(label="Chọn vật muốn thử nghiệm", choices=["Wall", "Countertop", "Floor", "Backsplash"], value="Wall")
+                    force_regenerate_input = gr.Checkbox(label="Tạo lại (bỏ qua kết quả đã lưu)", value=False)
                     size_radio_img2img = gr.Radio(choices=["1152x768", "1024x1024", "768x1152", "Custom size"], label="Chọn kích thước ảnh", value="1024x1024")
                     custom_size_input_img2img = gr.Textbox(label="Nhập kích thước tùy chỉnh (VD: 1280x720)", placeholder="Chiều rộng x Chiều cao", visible=False)
                     size_radio_img2img.change(fn=lambda x: gr.update(visible=x == "Custom size"), inputs=size_radio_img2img, outputs=custom_size_input_img2img)
                     product_checkbox_group_img2img = []
-                    for group, color in GROUP_COLORS.items():
+                    for group, labels in IMG2IMG_PRODUCT_GROUPS.items():
                         with gr.Accordion(f"Sản phẩm - {group}", open=False):
+                            product_thumbnails(labels)
                             checkboxes = gr.CheckboxGroup(
-                                choices=[(code, code) for code in PRODUCT_GROUPS[group] if PRODUCT_GROUPS[group][code] not in ["is coming", "is loading"]],
+                                choices=[(label, label) for label in labels],
                                 label=f"Chọn sản phẩm ({group})",
                                 value=[]
                             )
                             product_checkbox_group_img2img.append((group, checkboxes))
                     inpaint_button = gr.Button("Inpaint")
                 with gr.Column():
-                    output_image_img2img = gr.Image(label="Ảnh đã tạo")
+                    output_image_img2img = gr.Gallery(label="Ảnh đã tạo", columns=2)
                     error_message_img2img = gr.Textbox(label="Thông báo", visible=False)
                     loading_spinner_img2img = gr.HTML('<div class="loading-spinner"></div>', visible=False)
                     progress_bar_img2img = gr.HTML('', visible=False)
-            inputs_img2img = [image_upload, position_input, size_radio_img2img, custom_size_input_img2img] + [checkboxes for _, checkboxes in product_checkbox_group_img2img]
+            inputs_img2img = [image_upload, position_input, size_radio_img2img, custom_size_input_img2img, force_regenerate_input] + [checkboxes for _, checkboxes in product_checkbox_group_img2img]
             inpaint_button.click(fn=generate_img2img, inputs=inputs_img2img, outputs=[error_message_img2img, loading_spinner_img2img, progress_bar_img2img, output_image_img2img])
 
-demo.launch(share=True)
\ No newline at end of file
+# Giới hạn đồng thời và thứ tự phục vụ do FairScheduler đảm nhiệm; mặc định của Gradio
+# (1 request mỗi event) sẽ xếp mọi request thành hàng trước khi tới scheduler
+demo.queue(default_concurrency_limit=None)
+
+startup_profile.mark("build ui")
+
+def on_server_start():
+    startup_profile.set_ready()
+    start_warmup()
+
+# Chỉ khởi chạy server khi chạy trực tiếp; import module (vd. benchmark.py) thì không
+if __name__ == "__main__":
+    if callback_base_url:
+        # Chạy Gradio trên FastAPI để nhận callback của TensorArt cùng cổng
+        import uvicorn
+        from fastapi import FastAPI
+
+        server = FastAPI()
+        server.include_router(create_health_router(startup_profile, warmup_status))
+        server.include_router(create_callback_router(job_engine, callback_secret))
+        server.include_router(telemetry.create_metrics_router())
+        server.add_event_handler("startup", on_server_start)
+        server = gr.mount_gradio_app(server, demo, path="/")
+        uvicorn.run(server, host=os.getenv('GRADIO_SERVER_NAME', '0.0.0.0'), port=int(os.getenv('GRADIO_SERVER_PORT', '7860')))
+    else:
+        demo.launch(share=True, prevent_thread_lock=True)
+        demo.app.include_router(create_health_router(startup_profile, warmup_status))
+        demo.app.include_router(telemetry.create_metrics_router())
+        on_server_start()
+        demo.block_thread()
\ No newline at end of file
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from PIL import Image
+
+from fake_tensorart import FakeTensorArt
+from readiness import percentile
+
+# Benchmark end-to-end không cần API key: chạy FakeTensorArt trong process, import app trỏ tới
+# server giả rồi gọi thẳng các handler Gradio với N người dùng đồng thời, đo từng giai đoạn.
+#   python benchmark.py --users 8 --requests 3 --mode mixed
+#   python benchmark.py --users 8 --json after.json --baseline before.json
+# Với --baseline, thoát mã 1 nếu p95 của giai đoạn nào chậm hơn quá --max-regression.
+
+REPO_DIR = Path(__file__).resolve().parent
+# Thư mục app đọc theo đường dẫn tương đối; được link vào thư mục làm việc tạm
+APP_ASSETS = ("product_images", "processed_textures", "workflows", "product_catalog.json")
+
+
+# Gom thời gian theo giai đoạn; wrap() bọc hàm sync, coroutine hoặc async generator
+class StageTimer:
+    def __init__(self):
+        self.enabled = False
+        self.samples = {}
+
+    def record(self, stage, elapsed):
+        if self.enabled:
+            self.samples.setdefault(stage, []).append(elapsed)
+
+    def wrap(self, stage, fn):
+        if inspect.isasyncgenfunction(fn):
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        elif inspect.iscoroutinefunction(fn):
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        else:
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        return wrapper
+
+    def report(self):
+        report = {}
+        for stage, values in sorted(self.samples.items()):
+            report[stage] = {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "mean": sum(values) / len(values),
+            }
+        return report
+
+
+# Chuẩn bị thư mục làm việc + biến môi trường rồi import app (app đọc cấu hình lúc import)
+def load_app(api_url, workdir):
+    for name in APP_ASSETS:
+        if (REPO_DIR / name).exists() and not (workdir / name).exists():
+            os.symlink(REPO_DIR / name, workdir / name)
+    os.chdir(workdir)
+    os.environ['TENSORART_API_URL'] = api_url
+    os.environ.pop('TENSORART_CALLBACK_URL', None)
+    os.environ.setdefault('api_key_token', 'benchmark-key')
+    sys.path.insert(0, str(REPO_DIR))
+    import app
+    app.start_warmup()
+    return app
+
+
+def instrument(app, timer):
+    app.queue_updates = timer.wrap("queue_wait", app.queue_updates)
+    app.upload_image_bytes_to_tensorart = timer.wrap("upload", app.upload_image_bytes_to_tensorart)
+    app.generate_surface_mask = timer.wrap("surface_mask", app.generate_surface_mask)
+    app.generate_mask = timer.wrap("render_product", app.generate_mask)
+    app.txt2img = timer.wrap("txt2img_job", app.txt2img)
+    app.params_checker.check_template = timer.wrap("params_check", app.params_checker.check_template)
+    app.job_engine.download = timer.wrap("download", app.job_engine.download)
+
+
+# Ảnh đầu vào khác nhau cho mỗi request để không trúng cache mask/kết quả
+def synthetic_image(seed, width=1024, height=768):
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    image.putpixel((rng.randrange(width), rng.randrange(height)), (rng.randrange(256), 0, 0))
+    return image
+
+
+def product_choices(groups, products):
+    return [products] + [[] for _ in range(len(groups) - 1)]
+
+
+async def run_img2img(app, user, index, args):
+    request = SimpleNamespace(session_hash=f"bench-{user}", username=None, query_params={})
+    image = synthetic_image(0 if args.cached else f"{user}-{index}")
+    last = None
+    async for update in app.generate_img2img(request, image, args.position, "1024x1024", "", not args.cached,
+                                             *product_choices(app.IMG2IMG_PRODUCT_GROUPS, args.products)):
+        last = update
+    return bool(last and last[0] and str(last[0]).startswith("Hoàn tất"))
+
+
+async def run_txt2img(app, user, index, args):
+    request = SimpleNamespace(session_hash=f"bench-{user}", username=None, query_params={})
+    last = None
+    async for update in app.generate_with_loading(request, f"benchmark prompt {user}-{index}", "1024x1024", "",
+                                                  args.batch, -1, False,
+                                                  *product_choices(app.TXT2IMG_PRODUCT_GROUPS, args.products)):
+        last = update
+    return bool(last and isinstance(last[3], list) and last[3])
+
+
+async def user_loop(app, timer, user, count, args, results):
+    for index in range(count):
+        mode = args.mode if args.mode != "mixed" else ("img2img" if (user + index) % 2 == 0 else "txt2img")
+        runner = run_img2img if mode == "img2img" else run_txt2img
+        start = time.perf_counter()
+        try:
+            ok = await runner(app, user, index, args)
+        except Exception as e:
+            print(f"User {user} request {index} crashed: {e}")
+            ok = False
+        timer.record(f"{mode}_total", time.perf_counter() - start)
+        results.append(ok)
+
+
+async def run_benchmark(app, timer, args):
+    # Lượt khởi động (không tính): upload texture, params check lần đầu, kết nối
+    await asyncio.gather(*(user_loop(app, timer, -1 - user, 1, args, []) for user in range(args.warmup)))
+    timer.enabled = True
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(user_loop(app, timer, user, args.requests, args, results) for user in range(args.users)))
+    return results, time.perf_counter() - start
+
+
+def print_report(report):
+    print(f"{'stage':<16}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'mean':>9}")
+    for stage, row in report["stages"].items():
+        print(f"{stage:<16}{row['count']:>7}{row['p50']:>9.2f}{row['p95']:>9.2f}{row['p99']:>9.2f}{row['mean']:>9.2f}")
+    print(f"throughput: {report['throughput']:.2f} req/s ({report['ok']} ok, {report['failed']} failed "
+          f"in {report['wall_time']:.1f}s); fake server: {report['fake_requests']} requests, "
+          f"{report['injected_errors']} injected errors")
+
+
+# So p95 từng giai đoạn với lần chạy trước; trả về danh sách giai đoạn chậm đi quá ngưỡng
+# (bỏ qua chênh lệch tuyệt đối dưới min_delta giây của các giai đoạn rất ngắn)
+def regressions(report, baseline, max_regression, min_delta):
+    slower = []
+    for stage, row in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if (before and row["p95"] > before["p95"] * (1 + max_regression)
+                and row["p95"] - before["p95"] >= min_delta):
+            slower.append(f"{stage}: p95 {before['p95']:.2f}s -> {row['p95']:.2f}s")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark against a fake TensorArt")
+    parser.add_argument("--users", type=int, default=4, help="concurrent users")
+    parser.add_argument("--requests", type=int, default=2, help="requests per user")
+    parser.add_argument("--mode", choices=["img2img", "txt2img", "mixed"], default="mixed")
+    parser.add_argument("--products", nargs="+", default=["C1012 Glacier White", "C1026 Polar"])
+    parser.add_argument("--position", default="Wall")
+    parser.add_argument("--batch", type=int, default=1, help="Text2Img variations per job")
+    parser.add_argument("--cached", action="store_true", help="reuse one input image and allow result cache hits")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured requests before the run")
+    parser.add_argument("--queue-time", type=float, default=0.5)
+    parser.add_argument("--run-time", type=float, default=2.0)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--http-error-rate", type=float, default=0.0)
+    parser.add_argument("--job-failure-rate", type=float, default=0.0)
+    parser.add_argument("--workdir", default=None, help="working directory for caches and images (default: temp)")
+    parser.add_argument("--json", dest="json_path", default=None, help="write the report to this file")
+    parser.add_argument("--baseline", default=None, help="report from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative p95 slowdown")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="ignore p95 slowdowns below this many seconds")
+    args = parser.parse_args()
+    # app chạy trong thư mục làm việc riêng nên cố định đường dẫn report trước khi chdir
+    json_path = Path(args.json_path).resolve() if args.json_path else None
+    baseline_path = Path(args.baseline).resolve() if args.baseline else None
+
+    fake = FakeTensorArt(port=0, queue_time=args.queue_time, run_time=args.run_time, latency=args.latency,
+                         jitter=args.jitter, http_error_rate=args.http_error_rate,
+                         job_failure_rate=args.job_failure_rate).start()
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="bench_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    app = load_app(fake.api_url, workdir)
+    timer = StageTimer()
+    instrument(app, timer)
+
+    results, wall_time = asyncio.run(run_benchmark(app, timer, args))
+    fake.stop()
+    report = {
+        "config": vars(args),
+        "stages": timer.report(),
+        "ok": sum(results),
+        "failed": len(results) - sum(results),
+        "wall_time": wall_time,
+        "throughput": len(results) / wall_time if wall_time else 0.0,
+        "fake_requests": fake.requests,
+        "injected_errors": fake.injected_errors,
+    }
+    print_report(report)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            slower = regressions(report, json.load(f), args.max_regression, args.min_delta)
+        if slower:
+            print("Regressions:\n  " + "\n  ".join(slower))
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
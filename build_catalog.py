@@ -0,0 +1,156 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from build_textures import BUILD_VERSION, MANIFEST_NAME, OUTPUT_DIR, file_sha256, load_manifest
+
+# Bước build offline (sau build_textures.py): đọc danh mục sản phẩm trong product_catalog.json,
+# kiểm tra ảnh từng mã một lần và ghi index gọn (nhóm, model ID, texture dùng để upload, hash,
+# kích thước, thumbnail WebP) để app dựng danh sách chọn sản phẩm mà không phải đọc lại ảnh.
+#   python build_catalog.py --strict
+CATALOG_SOURCE = "product_catalog.json"
+INDEX_NAME = "catalog.json"
+THUMBNAIL_DIR = "thumbnails"
+THUMBNAIL_SIZE = 192
+THUMBNAIL_QUALITY = 75
+# Đổi khi thay cấu trúc index hoặc cách làm thumbnail để build lại toàn bộ
+INDEX_VERSION = "catalog-v1"
+
+
+def _json_sha256(path):
+    path = Path(path)
+    if not path.exists():
+        return None
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def build_thumbnail(source_path, output_path, size=THUMBNAIL_SIZE):
+    with Image.open(source_path) as source:
+        source.draft('RGB', (size * 2, size * 2))
+        image = ImageOps.exif_transpose(source).convert('RGB')
+    image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    image.save(output_path, format='WEBP', quality=THUMBNAIL_QUALITY, method=6)
+    return str(output_path)
+
+
+# Texture dùng cho một ảnh nguồn: bản đã tile sẵn nếu manifest khớp đúng ảnh nguồn, không thì ảnh gốc
+def _resolve_texture(source_path, source_sha256, manifest):
+    entry = manifest.get(Path(source_path).stem)
+    if (entry and entry.get('version') == BUILD_VERSION and entry.get('source_sha256') == source_sha256
+            and os.path.exists(entry['texture'])):
+        return entry['texture'], entry['sha256'], (entry['width'], entry['height']), True
+    with Image.open(source_path) as image:
+        return str(source_path), source_sha256, image.size, False
+
+
+def _index_entry(product, manifest, thumbnail_dir, previous):
+    label = f"{product['code']} {product['name']}"
+    entry = {
+        "code": product['code'],
+        "label": label,
+        "group": product['group'],
+        "model_id": product.get('model_id'),
+        "image": product.get('image'),
+        "available": False,
+        "reason": None,
+    }
+    if not entry['model_id']:
+        entry['reason'] = "coming soon"
+        return entry
+    if not entry['image'] or not os.path.exists(entry['image']):
+        entry['reason'] = f"missing image {entry['image']}"
+        return entry
+    source_sha256 = file_sha256(entry['image'])
+    texture, texture_sha256, (width, height), pretiled = _resolve_texture(entry['image'], source_sha256, manifest)
+    thumbnail = thumbnail_dir / f"{product['code']}.webp"
+    old = previous.get(label) or {}
+    if old.get('source_sha256') != source_sha256 or not thumbnail.exists():
+        build_thumbnail(entry['image'], thumbnail)
+    entry.update({
+        "available": True,
+        "source_sha256": source_sha256,
+        "texture": texture,
+        "sha256": texture_sha256,
+        "width": width,
+        "height": height,
+        "pretiled": pretiled,
+        "thumbnail": str(thumbnail),
+    })
+    return entry
+
+
+def load_catalog_source(source=CATALOG_SOURCE):
+    with open(source, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_index(output_dir=OUTPUT_DIR):
+    index_path = Path(output_dir) / INDEX_NAME
+    if not index_path.exists():
+        return None
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Index còn đúng nếu cùng phiên bản, cùng file danh mục và cùng manifest texture lúc build
+def is_current(index, source=CATALOG_SOURCE, output_dir=OUTPUT_DIR):
+    return bool(index) and index.get('version') == INDEX_VERSION \
+        and index.get('source_sha256') == _json_sha256(source) \
+        and index.get('manifest_sha256') == _json_sha256(Path(output_dir) / MANIFEST_NAME)
+
+
+def build_index(source=CATALOG_SOURCE, output_dir=OUTPUT_DIR):
+    output_dir = Path(output_dir)
+    thumbnail_dir = output_dir / THUMBNAIL_DIR
+    thumbnail_dir.mkdir(parents=True, exist_ok=True)
+    catalog = load_catalog_source(source)
+    manifest = load_manifest(output_dir)
+    previous = {entry['label']: entry for entry in (load_index(output_dir) or {}).get('products', [])}
+    groups = [group['name'] for group in catalog['groups']]
+    products = []
+    for product in catalog['products']:
+        if product['group'] not in groups:
+            raise ValueError(f"Product {product['code']} uses unknown group {product['group']}")
+        products.append(_index_entry(product, manifest, thumbnail_dir, previous))
+    index = {
+        "version": INDEX_VERSION,
+        "source_sha256": _json_sha256(source),
+        "manifest_sha256": _json_sha256(output_dir / MANIFEST_NAME),
+        "groups": catalog['groups'],
+        "products": products,
+    }
+    tmp_path = output_dir / (INDEX_NAME + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, output_dir / INDEX_NAME)
+    unavailable = [entry for entry in products if not entry['available']]
+    for entry in unavailable:
+        print(f"Unavailable product {entry['label']}: {entry['reason']}")
+    print(f"Catalog index: {len(products) - len(unavailable)} available, {len(unavailable)} unavailable")
+    return index
+
+
+# Dùng index đã build; build lại nếu chưa có hoặc đã cũ (vd. sửa product_catalog.json mà chưa chạy build)
+def load_or_build_index(source=CATALOG_SOURCE, output_dir=OUTPUT_DIR):
+    index = load_index(output_dir)
+    if is_current(index, source, output_dir):
+        return index
+    print("Catalog index missing or stale, rebuilding (run build_catalog.py at build time to skip this)")
+    return build_index(source, output_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the product catalog index and thumbnails")
+    parser.add_argument("--src", default=CATALOG_SOURCE)
+    parser.add_argument("--out", default=OUTPUT_DIR)
+    parser.add_argument("--strict", action="store_true", help="exit non-zero if a product with a model ID has no image")
+    args = parser.parse_args()
+    result = build_index(args.src, args.out)
+    missing = [entry for entry in result['products'] if entry['model_id'] and not entry['available']]
+    if args.strict and missing:
+        sys.exit(1)
@@ -0,0 +1,134 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageChops, ImageOps
+
+# Bước build offline: biến mỗi ảnh trong product_images/ thành texture liền mạch (seamless),
+# đã tile và đúng kích thước node 17 của workflow, để TensorArt không phải resize/tile mỗi job.
+#   python build_textures.py --workers 4
+
+# Khớp với node 10 (Image Seamless Texture) và node 17 (TensorArt_LoadImage) của workflow
+TEXTURE_WIDTH = 512
+TEXTURE_HEIGHT = 768
+BLENDING = 0.37
+TILES = 2
+# Đổi khi thay thuật toán để build lại toàn bộ
+BUILD_VERSION = "seamless-v1"
+
+SOURCE_DIR = "product_images"
+OUTPUT_DIR = "processed_textures"
+MANIFEST_NAME = "manifest.json"
+
+
+def file_sha256(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Mask 1 ở giữa, giảm dần về 0 ở mép; độ rộng vùng chuyển tiếp theo blending
+def _blend_mask(width, height, blending):
+    x = np.abs(np.linspace(-1.0, 1.0, width))
+    y = np.abs(np.linspace(-1.0, 1.0, height))
+    distance = np.maximum.outer(y, x)
+    weight = np.clip((1.0 - distance) / max(blending, 1e-3), 0.0, 1.0)
+    return Image.fromarray((weight * 255).astype(np.uint8))
+
+
+# Trộn ảnh với bản dịch nửa kích thước để mép trái/phải, trên/dưới khớp nhau
+def make_seamless(image, blending=BLENDING, tiles=TILES):
+    width, height = image.size
+    shifted = ImageChops.offset(image, width // 2, height // 2)
+    seamless = Image.composite(image, shifted, _blend_mask(width, height, blending))
+    if tiles > 1:
+        tiled = Image.new('RGB', (width * tiles, height * tiles))
+        for row in range(tiles):
+            for col in range(tiles):
+                tiled.paste(seamless, (col * width, row * height))
+        seamless = tiled.resize((width, height), Image.LANCZOS)
+    return seamless
+
+
+def build_texture(source_path, output_path, width=TEXTURE_WIDTH, height=TEXTURE_HEIGHT):
+    with Image.open(source_path) as source:
+        # Giảm kích thước sớm khi decode JPEG lớn để tiết kiệm bộ nhớ
+        source.draft('RGB', (width * 2, height * 2))
+        image = ImageOps.exif_transpose(source).convert('RGB')
+    image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+    texture = make_seamless(image)
+    texture.save(output_path, format='JPEG', quality=90, optimize=True, progressive=True)
+    return {
+        "source": str(source_path),
+        "source_sha256": file_sha256(source_path),
+        "texture": str(output_path),
+        "sha256": file_sha256(output_path),
+        "width": width,
+        "height": height,
+        "bytes": os.path.getsize(output_path),
+        "source_bytes": os.path.getsize(source_path),
+        "version": BUILD_VERSION,
+    }
+
+
+def _build_one(args):
+    code, source_path, output_path = args
+    try:
+        return code, build_texture(source_path, output_path), None
+    except Exception as e:
+        return code, None, str(e)
+
+
+def load_manifest(output_dir=OUTPUT_DIR):
+    manifest_path = Path(output_dir) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Build song song; bỏ qua sản phẩm có ảnh nguồn và phiên bản không đổi
+def build_all(source_dir=SOURCE_DIR, output_dir=OUTPUT_DIR, workers=None, force=False):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {} if force else load_manifest(output_dir)
+    jobs = []
+    for source_path in sorted(Path(source_dir).glob('*.jpg')):
+        code = source_path.stem
+        output_path = output_dir / f"{code}.jpg"
+        entry = manifest.get(code)
+        if (entry and entry.get('version') == BUILD_VERSION and output_path.exists()
+                and entry.get('source_sha256') == file_sha256(source_path)):
+            continue
+        jobs.append((code, str(source_path), str(output_path)))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for code, entry, error in executor.map(_build_one, jobs):
+            if error:
+                print(f"Failed to build texture for {code}: {error}")
+                continue
+            manifest[code] = entry
+            print(f"Built {entry['texture']}: {entry['source_bytes']} -> {entry['bytes']} bytes")
+
+    tmp_path = output_dir / (MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, output_dir / MANIFEST_NAME)
+    print(f"Texture manifest: {len(manifest)} products ({len(jobs)} rebuilt)")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-build seamless, right-sized product textures")
+    parser.add_argument("--src", default=SOURCE_DIR)
+    parser.add_argument("--out", default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+    build_all(args.src, args.out, args.workers, args.force)
@@ -0,0 +1,253 @@
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.request import Request, urlopen
+
+from PIL import Image
+
+# Server TensorArt giả lập chạy local để thử app không cần API key thật:
+#   python fake_tensorart.py --port 8787
+#   TENSORART_API_URL=http://127.0.0.1:8787/v1 python app.py
+# Job đi qua QUEUED -> RUNNING -> SUCCESS và gửi callback tới runningNotifyUrl nếu có.
+# Có thể giả lập độ trễ mạng (latency ± jitter cho mỗi request API), lỗi HTTP 503 ngẫu nhiên
+# (http_error_rate) và job thất bại (job_failure_rate) để đo app trong điều kiện xấu.
+# resource_sync_time: resource vừa PUT chưa dùng được ngay, job dùng nó bị từ chối với lỗi
+# "resource ... not found" như TensorArt khi resource chưa đồng bộ.
+
+
+class FakeTensorArt:
+    def __init__(self, host="127.0.0.1", port=8787, queue_time=1.0, run_time=3.0,
+                 latency=0.0, jitter=0.0, http_error_rate=0.0, job_failure_rate=0.0, resource_sync_time=0.0):
+        self.queue_time = queue_time
+        self.run_time = run_time
+        self.latency = latency
+        self.jitter = jitter
+        self.http_error_rate = http_error_rate
+        self.job_failure_rate = job_failure_rate
+        self.resource_sync_time = resource_sync_time
+        self.requests = 0
+        self.injected_errors = 0
+        self.unsynced_submits = 0
+        self.params_checks = 0
+        self.uploaded_at = {}
+        self.jobs = {}
+        self.resources = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.base_url = f"http://{host}:{self.server.server_address[1]}"
+
+    @property
+    def api_url(self):
+        return f"{self.base_url}/v1"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    # Chờ theo độ trễ giả lập; True nếu request này nên trả lỗi 503
+    def simulate(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        with self._lock:
+            self.requests += 1
+            failed = random.random() < self.http_error_rate
+            if failed:
+                self.injected_errors += 1
+        return failed
+
+    def _next_id(self):
+        with self._lock:
+            return str(800000000000000000 + next(self._ids))
+
+    def job_view(self, job_id):
+        job = self.jobs[job_id]
+        elapsed = time.time() - job['created']
+        view = {"id": job_id}
+        if elapsed < self.queue_time:
+            view["status"] = "QUEUED"
+            view["waitingInfo"] = {"queueRank": "1", "queueLen": "1"}
+        elif elapsed < self.queue_time + self.run_time:
+            view["status"] = "RUNNING"
+            view["runningInfo"] = {"progress": round((elapsed - self.queue_time) / self.run_time, 2)}
+        elif job['failed']:
+            view["status"] = "FAILED"
+            view["failedInfo"] = {"reason": "Simulated failure", "code": 500}
+        else:
+            view["status"] = "SUCCESS"
+            view["successInfo"] = {"images": [
+                {"url": f"{self.base_url}/images/{job_id}_{i}.png", "seed": str(job['seed'] + i)} for i in range(job['count'])
+            ]}
+        return view
+
+    # resourceId trong graph đã upload nhưng chưa qua resource_sync_time
+    def unsynced_resource(self, body):
+        params = body.get('params')
+        if not isinstance(params, dict):
+            return None
+        now = time.time()
+        for node in params.values():
+            resource_id = node.get('inputs', {}).get('image') if node.get('classType') == 'TensorArt_LoadImage' else None
+            if resource_id in self.uploaded_at and now - self.uploaded_at[resource_id] < self.resource_sync_time:
+                return resource_id
+        return None
+
+    def create_job(self, body):
+        job_id = self._next_id()
+        count, seed = 1, -1
+        # Workflow trả về một ảnh cho mỗi node xuất ảnh
+        params = body.get('params')
+        if isinstance(params, dict):
+            count = max(1, sum(1 for node in params.values() if node.get('classType') in ("PreviewImage", "SaveImage")))
+        for stage in body.get('stages', []):
+            if stage.get('type') == 'INPUT_INITIALIZE':
+                count = stage['inputInitialize'].get('count', 1)
+                seed = stage['inputInitialize'].get('seed', -1)
+        if seed < 0:
+            seed = random.randrange(2 ** 32)
+        self.jobs[job_id] = {"created": time.time(), "count": count, "seed": seed, "request": body,
+                             "failed": random.random() < self.job_failure_rate}
+        notify_url = body.get('runningNotifyUrl')
+        if notify_url:
+            threading.Thread(target=self._notify_loop, args=(job_id, notify_url), daemon=True).start()
+        return {"job": {"id": job_id, "status": "QUEUED"}}
+
+    # Gửi callback mỗi khi job đổi trạng thái
+    def _notify_loop(self, job_id, notify_url):
+        last_status = None
+        while True:
+            view = self.job_view(job_id)
+            if view["status"] != last_status:
+                last_status = view["status"]
+                data = json.dumps({"job": view}).encode()
+                try:
+                    urlopen(Request(notify_url, data=data, headers={'Content-Type': 'application/json'}), timeout=5)
+                except Exception as e:
+                    print(f"Fake notify to {notify_url} failed: {e}")
+            if last_status in ("SUCCESS", "FAILED"):
+                return
+            time.sleep(0.1)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _read_json(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                return json.loads(raw) if raw else {}
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _authorized(self):
+                if not self.headers.get('Authorization', '').startswith('Bearer '):
+                    self._send_json(401, {"message": "Unauthorized"})
+                    return False
+                return True
+
+            def _injected_error(self):
+                if fake.simulate():
+                    self._send_json(503, {"message": "Simulated outage"})
+                    return True
+                return False
+
+            def do_POST(self):
+                body = self._read_json()
+                if not self.path.startswith('/v1/'):
+                    return self._send_json(404, {"message": "Not found"})
+                if not self._authorized() or self._injected_error():
+                    return
+                if self.path == '/v1/resource/image':
+                    resource_id = fake._next_id()
+                    fake.resources[resource_id] = None
+                    return self._send_json(200, {
+                        "resourceId": resource_id,
+                        "putUrl": f"{fake.base_url}/upload/{resource_id}",
+                        "headers": {"Content-Type": "image/jpeg"},
+                    })
+                if self.path == '/v1/jobs/workflow/params/check':
+                    fake.params_checks += 1
+                    return self._send_json(200, {"valid": True})
+                if self.path in ('/v1/jobs', '/v1/jobs/workflow'):
+                    resource_id = fake.unsynced_resource(body)
+                    if resource_id:
+                        fake.unsynced_submits += 1
+                        return self._send_json(400, {"message": f"resource {resource_id} not found"})
+                    return self._send_json(200, fake.create_job(body))
+                self._send_json(404, {"message": "Not found"})
+
+            def do_PUT(self):
+                if not self.path.startswith('/upload/'):
+                    return self._send_json(404, {"message": "Not found"})
+                length = int(self.headers.get('Content-Length') or 0)
+                if self._injected_error():
+                    self.rfile.read(length)
+                    return
+                resource_id = self.path.rsplit('/', 1)[-1]
+                fake.resources[resource_id] = self.rfile.read(length)
+                fake.uploaded_at[resource_id] = time.time()
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                if self.path.startswith('/v1/jobs/'):
+                    if not self._authorized() or self._injected_error():
+                        return
+                    job_id = self.path.rsplit('/', 1)[-1]
+                    if job_id not in fake.jobs:
+                        return self._send_json(404, {"message": "Job not found"})
+                    return self._send_json(200, {"job": fake.job_view(job_id)})
+                if self.path.startswith('/images/'):
+                    if self._injected_error():
+                        return
+                    buffer = BytesIO()
+                    Image.new('RGB', (64, 64), (200, 200, 200)).save(buffer, format='PNG')
+                    data = buffer.getvalue()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'image/png')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                self._send_json(404, {"message": "Not found"})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake TensorArt API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--queue-time", type=float, default=1.0)
+    parser.add_argument("--run-time", type=float, default=3.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="± random seconds around --latency")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--job-failure-rate", type=float, default=0.0, help="fraction of jobs that end FAILED")
+    parser.add_argument("--resource-sync-time", type=float, default=0.0,
+                        help="seconds after upload before jobs may use a resource")
+    args = parser.parse_args()
+    fake = FakeTensorArt(args.host, args.port, args.queue_time, args.run_time,
+                         args.latency, args.jitter, args.http_error_rate, args.job_failure_rate,
+                         args.resource_sync_time)
+    print(f"Fake TensorArt listening on {fake.api_url}")
+    fake.server.serve_forever()
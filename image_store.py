@@ -0,0 +1,141 @@
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+# Phần mở rộng -> định dạng PIL
+FORMATS = {'.jpg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP'}
+# Tên file do store ghi: 32 ký tự hex của hash nội dung + phần mở rộng trong FORMATS
+STORED_NAME = re.compile(r'^[0-9a-f]{32}(%s)$' % '|'.join(re.escape(suffix) for suffix in FORMATS))
+# Chu kỳ dọn file quá hạn khi không có gì để ghi
+HOUSEKEEPING_SEC = 600
+
+
+# Kho ảnh sinh ra: tên file theo hash nội dung (không trùng giữa các request chạy song song),
+# encode + ghi file trên một thread nền, giới hạn tổng dung lượng và tuổi file, loại bỏ theo LRU.
+# Là nơi duy nhất xoá file trong thư mục; các cache kết quả chỉ giữ đường dẫn tới đây.
+class ImageStore:
+    def __init__(self, root, max_bytes, max_age_sec):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._index = self._scan()
+        self._total_bytes = sum(entry['size'] for entry in self._index.values())
+        with self._lock:
+            self._evict()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="image-store-writer", daemon=True)
+        self._writer.start()
+
+    # Dựng index từ các file store đã ghi, theo thứ tự mtime. File khác trong thư mục
+    # (ảnh mẫu, ảnh upload, file cũ đặt tên theo timestamp) không bị đụng tới.
+    def _scan(self):
+        entries = []
+        for path in self.root.iterdir():
+            if path.is_file() and STORED_NAME.match(path.name):
+                stat = path.stat()
+                entries.append((path.name, {'size': stat.st_size, 'last_used': stat.st_mtime}))
+        entries.sort(key=lambda item: item[1]['last_used'])
+        return OrderedDict(entries)
+
+    def _evict(self, keep=None):
+        expire_before = time.time() - self.max_age_sec
+        for name in list(self._index):
+            entry = self._index[name]
+            if self._total_bytes <= self.max_bytes and entry['last_used'] >= expire_before:
+                break
+            if name == keep:
+                continue
+            del self._index[name]
+            self._total_bytes -= entry['size']
+            self.evicted += 1
+            try:
+                os.remove(self.root / name)
+            except OSError:
+                pass
+            print(f"Image store evicted {name}")
+
+    # Lưu ảnh tải về: giữ nguyên bytes nếu đã đúng định dạng, nếu không thì encode lại; trả về Future -> đường dẫn file
+    def save_download(self, data, suffix):
+        def encode():
+            image = Image.open(BytesIO(data))
+            if image.format == FORMATS[suffix]:
+                return data
+            return self._encode(image, suffix)
+        return self._submit(encode, suffix)
+
+    def _encode(self, image, suffix):
+        # JPEG không hỗ trợ RGBA (hoặc các mode khác) nên chuyển sang RGB
+        if FORMATS[suffix] == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffer = BytesIO()
+        image.save(buffer, format=FORMATS[suffix])
+        return buffer.getvalue()
+
+    def _submit(self, encode, suffix):
+        future = Future()
+        self._queue.put((encode, suffix, future))
+        return future
+
+    def _write_loop(self):
+        while True:
+            try:
+                encode, suffix, future = self._queue.get(timeout=HOUSEKEEPING_SEC)
+            except queue.Empty:
+                with self._lock:
+                    self._evict()
+                continue
+            try:
+                future.set_result(self._write(encode(), suffix))
+            except Exception as e:
+                print(f"Image store write failed: {str(e)}")
+                future.set_exception(e)
+
+    def _write(self, data, suffix):
+        name = hashlib.sha256(data).hexdigest()[:32] + suffix
+        path = self.root / name
+        with self._lock:
+            if name in self._index and path.exists():
+                self._touch(name)
+                return str(path)
+        tmp_path = self.root / (name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            old = self._index.pop(name, None)
+            if old:
+                self._total_bytes -= old['size']
+            self._index[name] = {'size': len(data), 'last_used': time.time()}
+            self._total_bytes += len(data)
+            self._evict(keep=name)
+        return str(path)
+
+    def _touch(self, name):
+        self._index[name]['last_used'] = time.time()
+        self._index.move_to_end(name)
+
+    # Đánh dấu file vừa được dùng lại (cache hit); False nếu file đã bị loại khỏi kho
+    def touch(self, path):
+        name = Path(path).name
+        with self._lock:
+            if name not in self._index:
+                return False
+            self._touch(name)
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {'files': len(self._index), 'bytes': self._total_bytes,
+                    'evicted': self.evicted, 'pending_writes': self._queue.qsize()}
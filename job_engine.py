@@ -0,0 +1,413 @@
+import asyncio
+import threading
+import time
+
+import httpx
+
+import telemetry
+from readiness import POLICIES, BackoffPolicy
+from telemetry import metrics, record_span
+from tensorart_client import RETRY_STATUSES
+
+NON_TERMINAL_STATUSES = ('CREATED', 'PENDING', 'QUEUED', 'WAITING', 'RUNNING')
+MAX_EARLY_NOTICES = 1000
+# Backoff giữa các lần thử lại GET (giống backoff_factor của client đồng bộ)
+RETRY_BACKOFF = 0.5
+
+
+class JobFailed(Exception):
+    def __init__(self, job_id, reason, code):
+        super().__init__(f"Job {job_id} failed: {reason} (code: {code})")
+        self.job_id = job_id
+        self.reason = reason
+        self.code = code
+
+
+class JobTimeout(Exception):
+    pass
+
+
+# Thông tin một job đang chờ kết quả
+class _TrackedJob:
+    def __init__(self, job_id, kind, name, future, policy, loop_time, trace_id=None, key=None):
+        self.job_id = job_id
+        self.kind = kind
+        self.name = name
+        self.future = future
+        self.delays = policy.delays()
+        self.started = loop_time
+        self.deadline = loop_time + policy.timeout
+        self.next_poll = loop_time + next(self.delays)
+        self.attempts = 0
+        # Mọi request đang chờ job này (request trùng key gắn thêm listener của mình)
+        self.listeners = []
+        self.last = None
+        self.trace_id = trace_id
+        self.key = key
+        # Thời điểm (loop.time) lần đầu thấy RUNNING, để tách thời gian chờ hàng đợi và thời gian chạy
+        self.running_at = None
+
+
+# Engine chạy trên một event loop riêng: gửi job, theo dõi mọi job đang chạy
+# trong một vòng poll duy nhất và trả kết quả qua future của từng job.
+# Cấu hình pool, timeout và header lấy từ TensorArtClient dùng chung.
+class JobEngine:
+    def __init__(self, client, stats=None, fallback_poll_interval=None, journal=None):
+        self.base_url = client.base_url
+        self.headers = client.headers
+        self.stats = stats
+        self.journal = journal
+        self.max_connections = client.pool_size
+        self.retries = client.retries
+        self.timeout = client.timeout
+        # Khi có webhook, poll chỉ còn là dự phòng nên giãn khoảng cách tối thiểu
+        self.fallback_poll_interval = fallback_poll_interval
+        self._start_lock = threading.Lock()
+        self._loop = None
+        self._client = None
+        self._wake = None
+        self._jobs = {}
+        # key -> task gửi/khôi phục job đang chạy, để request giống hệt dùng chung một job
+        self._by_key = {}
+        # Callback tới trước khi submit kịp trả về job_id
+        self._early_notices = {}
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                connect_timeout, read_timeout = self.timeout
+                limits = httpx.Limits(max_connections=self.max_connections,
+                                      max_keepalive_connections=self.max_connections)
+                self._client = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                    limits=limits,
+                    # Chỉ retry lỗi kết nối (request chưa được gửi đi)
+                    transport=httpx.AsyncHTTPTransport(retries=self.retries, limits=limits),
+                )
+                self._wake = asyncio.Event()
+                loop.create_task(self._poll_loop())
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=run, name="job-engine", daemon=True).start()
+            ready.wait()
+            self._loop = loop
+
+    def _call(self, coro):
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    # Gửi job và chờ tới khi SUCCESS; trả về dict 'job' cuối cùng.
+    # on_update(job) được gọi trên event loop của người gọi mỗi khi nhận được trạng thái mới.
+    # key: định danh nội dung của job; request cùng key gắn vào job đang chạy (trong process
+    # hoặc ghi trong journal từ trước khi khởi động lại) thay vì gửi job mới.
+    async def run(self, path, payload, kind, name, on_update=None, key=None):
+        listener = None
+        if on_update:
+            caller_loop = asyncio.get_running_loop()
+
+            def listener(job):
+                caller_loop.call_soon_threadsafe(on_update, job)
+        # Event loop của engine không kế thừa contextvar của người gọi nên trace id được truyền tay
+        trace_id = telemetry.current_trace()
+        return await asyncio.wrap_future(self._call(self._submit_and_track(path, payload, kind, name, listener,
+                                                                           trace_id, key)))
+
+    # Tải nội dung (ảnh kết quả) qua cùng connection pool
+    async def download(self, url):
+        return await asyncio.wrap_future(self._call(self._download(url, telemetry.current_trace())))
+
+    async def _download(self, url, trace_id=None):
+        start = time.perf_counter()
+        error = None
+        try:
+            response = await self._get_with_retry(url, timeout=60.0)
+            response.raise_for_status()
+            return response.content
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            record_span("download", time.perf_counter() - start, trace_id, error)
+
+    # GET idempotent: thử lại khi lỗi mạng hoặc gặp RETRY_STATUSES (429/5xx), backoff tăng dần.
+    # Transport của httpx chỉ tự retry lỗi kết nối.
+    async def _get_with_retry(self, url, **kwargs):
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = await self._client.get(url, **kwargs)
+            except httpx.TransportError:
+                if last:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or last:
+                    return response
+            metrics.inc('tensorart_retries_total', source='engine')
+            await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+    async def _submit_and_track(self, path, payload, kind, name, listener=None, trace_id=None, key=None):
+        if key is None:
+            job = await self._start(path, payload, kind, name, trace_id)
+        else:
+            starting = self._by_key.get(key)
+            if starting is None:
+                starting = asyncio.ensure_future(self._start(path, payload, kind, name, trace_id, key))
+                self._by_key[key] = starting
+                starting.add_done_callback(lambda task: self._start_finished(key, task))
+            else:
+                print(f"{name} request joins in-flight job ({key[:12]})")
+                metrics.inc('tensorart_jobs_coalesced_total', kind=kind, source='in_flight')
+            job = await asyncio.shield(starting)
+        if listener:
+            job.listeners.append(listener)
+            if job.last:
+                self._notify_listener(job, listener, job.last)
+        # Người gọi huỷ (đóng trang) thì job vẫn được theo dõi cho các request khác cùng key
+        return await asyncio.shield(job.future)
+
+    # Gửi job mới, hoặc khôi phục job còn đang chạy ghi trong journal cho cùng key
+    async def _start(self, path, payload, kind, name, trace_id, key=None):
+        loop = asyncio.get_running_loop()
+        policy = POLICIES.get(kind) or BackoffPolicy()
+        job_id, result = await self._resume(key, kind, name, policy)
+        resumed = job_id is not None
+        if not resumed:
+            job_id, result = await self._submit(path, payload, kind, name, trace_id)
+            if self.journal:
+                self.journal.record(job_id, key, kind, name, result.get('status'))
+        print(f"Tracking {name} job_id: {job_id}")
+        job = _TrackedJob(job_id, kind, name, loop.create_future(), policy, loop.time(), trace_id, key)
+        job.future.add_done_callback(lambda _: self._forget(job))
+        self._jobs[job_id] = job
+        if resumed:
+            # Trạng thái vừa lấy có thể đã là SUCCESS (job xong trong lúc process khởi động lại)
+            self._apply_status(job, result)
+        else:
+            self._emit(job, result)
+            if self.fallback_poll_interval:
+                job.next_poll = loop.time() + self._next_delay(job)
+        if job_id in self._early_notices:
+            self._on_notify(job_id, self._early_notices.pop(job_id))
+        self._wake.set()
+        return job
+
+    async def _resume(self, key, kind, name, policy):
+        if not key or not self.journal:
+            return None, {}
+        job_id = self.journal.find_active(key, policy.timeout)
+        if not job_id:
+            return None, {}
+        result = await self._fetch(job_id)
+        status = result.get('status')
+        if status not in NON_TERMINAL_STATUSES and status != 'SUCCESS':
+            # Job không còn (hết hạn, lỗi): gửi lại từ đầu
+            print(f"Journal job {job_id} for {name} not resumable ({status}), submitting again")
+            self.journal.update(job_id, status or 'LOST')
+            return None, {}
+        print(f"Resuming {name} job {job_id} from journal ({status})")
+        metrics.inc('tensorart_jobs_coalesced_total', kind=kind, source='journal')
+        return job_id, result
+
+    async def _submit(self, path, payload, kind, name, trace_id):
+        # payload có thể là chuỗi JSON đã dựng sẵn (template đã biên dịch) hoặc dict
+        body = {'content': payload} if isinstance(payload, (str, bytes)) else {'json': payload}
+        start = time.perf_counter()
+        try:
+            response = await self._client.post(path, headers=self.headers, timeout=300.0, **body)
+        except Exception as e:
+            record_span("job_submit", time.perf_counter() - start, trace_id, type(e).__name__, kind=kind)
+            raise
+        record_span("job_submit", time.perf_counter() - start, trace_id,
+                    None if response.status_code == 200 else f"HTTP {response.status_code}", kind=kind)
+        if telemetry.DEBUG:
+            print(f"{name} submit response: {response.status_code} - {response.text}")
+        else:
+            print(f"{name} submit response: {response.status_code}")
+        if response.status_code != 200:
+            raise Exception(f"Error {response.status_code}: {response.text}")
+        job = response.json()['job']
+        if not job.get('id'):
+            raise Exception("Không tìm thấy job_id trong response")
+        return job['id'], job
+
+    # Gửi job lỗi thì bỏ key để request sau gửi lại; gửi thành công thì key được bỏ khi job kết thúc
+    def _start_finished(self, key, task):
+        if task.cancelled() or task.exception():
+            self._by_key.pop(key, None)
+
+    def _forget(self, job):
+        self._jobs.pop(job.job_id, None)
+        if job.key:
+            self._by_key.pop(job.key, None)
+
+    def _record(self, job, ready, outcome):
+        if self.stats:
+            self.stats.record(job.kind, job.job_id, self._loop.time() - job.started, job.attempts, ready)
+        metrics.inc('tensorart_jobs_total', kind=job.kind, outcome=outcome)
+        if self.journal:
+            self.journal.update(job.job_id, outcome.upper())
+        error = None if ready else outcome
+        now = self._loop.time()
+        queued_until = job.running_at or now
+        record_span("job_queue", queued_until - job.started, job.trace_id, error if job.running_at is None else None,
+                    kind=job.kind, job_id=job.job_id)
+        if job.running_at is not None:
+            record_span("job_run", now - job.running_at, job.trace_id, error, kind=job.kind, job_id=job.job_id)
+
+    def _mark_running(self, job, result):
+        if job.running_at is None and result.get('status') == 'RUNNING':
+            job.running_at = self._loop.time()
+            if self.journal:
+                self.journal.update(job.job_id, 'RUNNING')
+
+    async def _fetch(self, job_id, name="job"):
+        try:
+            response = await self._client.get(f"/jobs/{job_id}", headers=self.headers)
+            response.raise_for_status()
+            return response.json()['job']
+        except Exception as e:
+            print(f"{name} job {job_id} status error: {str(e)}")
+            return {}
+
+    async def _poll(self, job):
+        try:
+            job.attempts += 1
+            metrics.inc('tensorart_job_polls_total', kind=job.kind)
+            result = await self._fetch(job.job_id, job.name)
+            print(f"{job.name} job {job.job_id} status (attempt {job.attempts}): {result.get('status')}")
+            self._apply_status(job, result)
+        except Exception as e:
+            self._fail(job, e)
+
+    def _next_delay(self, job):
+        delay = next(job.delays)
+        if self.fallback_poll_interval:
+            delay = max(delay, self.fallback_poll_interval)
+        return delay
+
+    def _emit(self, job, result):
+        if not result.get('status'):
+            return
+        job.last = result
+        for listener in job.listeners:
+            self._notify_listener(job, listener, result)
+
+    def _notify_listener(self, job, listener, result):
+        try:
+            listener(result)
+        except Exception as e:
+            print(f"{job.name} job {job.job_id} update listener error: {str(e)}")
+
+    # Cập nhật job theo trạng thái mới nhận được (từ poll hoặc webhook).
+    # Lỗi nội bộ (ghi thống kê, journal...) chỉ làm hỏng job đó, không làm dừng vòng poll.
+    def _apply_status(self, job, result):
+        try:
+            self._update_status(job, result)
+        except Exception as e:
+            self._fail(job, e)
+
+    def _update_status(self, job, result):
+        status = result.get('status')
+        if job.future.done():
+            return
+        self._emit(job, result)
+        self._mark_running(job, result)
+        # Trả kết quả cho người chờ trước, rồi mới ghi thống kê
+        if status == 'SUCCESS':
+            job.future.set_result(result)
+            self._record(job, True, 'success')
+        elif status in ['FAILED', 'ERROR']:
+            failed_info = result.get('failedInfo', {})
+            job.future.set_exception(JobFailed(job.job_id, failed_info.get('reason', 'Không có chi tiết'),
+                                               failed_info.get('code', 'Không xác định')))
+            self._record(job, False, 'failed')
+        elif self._loop.time() >= job.deadline:
+            self._expire(job)
+        else:
+            job.next_poll = self._loop.time() + self._next_delay(job)
+
+    def _expire(self, job):
+        metrics.inc('tensorart_timeouts_total', kind=job.kind)
+        if not job.future.done():
+            job.future.set_exception(JobTimeout(f"{job.name} job {job.job_id} timed out"))
+        self._record(job, False, 'timeout')
+
+    def _fail(self, job, error):
+        print(f"{job.name} job {job.job_id} tracking error: {str(error)}")
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    # Webhook báo job đổi trạng thái (gọi được từ thread khác). Trạng thái cuối kèm
+    # kết quả thì dùng luôn; trạng thái cuối thiếu chi tiết hoặc không rõ thì poll
+    # job đó ngay thay vì chờ tới lượt.
+    def notify(self, job_id, result=None):
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._on_notify, job_id, result or {})
+
+    def _on_notify(self, job_id, result):
+        job = self._jobs.get(job_id)
+        if job is None:
+            if len(self._early_notices) >= MAX_EARLY_NOTICES:
+                self._early_notices.pop(next(iter(self._early_notices)))
+            self._early_notices[job_id] = result
+            return
+        status = result.get('status')
+        print(f"{job.name} job {job_id} callback: {status}")
+        if status in NON_TERMINAL_STATUSES:
+            try:
+                self._emit(job, result)
+                self._mark_running(job, result)
+            except Exception as e:
+                self._fail(job, e)
+            return
+        if status == 'SUCCESS' and result.get('successInfo', {}).get('images'):
+            self._apply_status(job, result)
+        elif status in ['FAILED', 'ERROR'] and result.get('failedInfo'):
+            self._apply_status(job, result)
+        else:
+            job.next_poll = self._loop.time()
+        self._wake.set()
+
+    # Vòng lặp không bao giờ được dừng: lỗi bất ngờ chỉ được log rồi chạy tiếp
+    async def _poll_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await self._poll_once(loop)
+            except Exception as e:
+                print(f"Job engine poll loop error: {str(e)}")
+                await asyncio.sleep(1.0)
+
+    async def _poll_once(self, loop):
+        now = loop.time()
+        # Hết hạn thì dừng job dù poll có thành công hay không
+        for job in list(self._jobs.values()):
+            if not job.future.done() and now >= job.deadline:
+                try:
+                    self._expire(job)
+                except Exception as e:
+                    self._fail(job, e)
+        due = [job for job in list(self._jobs.values()) if job.next_poll <= now and not job.future.done()]
+        if due:
+            await asyncio.gather(*(self._poll(job) for job in due))
+        pending = [job for job in self._jobs.values() if not job.future.done()]
+        wake_at = min(min(job.next_poll, job.deadline) for job in pending) if pending else None
+        timeout = max(0.0, wake_at - loop.time()) if pending else None
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    # Số job đang được theo dõi
+    def in_flight(self):
+        return len(self._jobs)
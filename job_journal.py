@@ -0,0 +1,57 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+TERMINAL_STATUSES = ('SUCCESS', 'FAILED', 'ERROR', 'TIMEOUT', 'LOST')
+# Bản ghi cũ hơn mức này bị xoá khi mở journal
+RETENTION_SEC = 7 * 86400
+
+
+# Nhật ký job đã gửi lên TensorArt (SQLite). Mỗi job ghi kèm key nội dung của request
+# (vd. key cache kết quả) để sau khi khởi động lại, request giống hệt gắn vào job cũ
+# đang chạy thay vì gửi job mới.
+class JobJournal:
+    def __init__(self, path, retention_sec=RETENTION_SEC):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            key TEXT,
+            kind TEXT,
+            name TEXT,
+            status TEXT,
+            submitted_at REAL,
+            updated_at REAL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, submitted_at)")
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE updated_at < ?", (time.time() - retention_sec,))
+
+    def record(self, job_id, key, kind, name, status):
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (job_id, key, kind, name, status or 'CREATED', now, now))
+
+    def update(self, job_id, status):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                             (status, time.time(), job_id))
+
+    # job_id mới nhất của key còn chưa kết thúc và được gửi trong max_age giây gần đây
+    def find_active(self, key, max_age):
+        placeholders = ",".join("?" * len(TERMINAL_STATUSES))
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT job_id FROM jobs WHERE key = ? AND submitted_at >= ? AND status NOT IN ({placeholders}) "
+                "ORDER BY submitted_at DESC LIMIT 1",
+                (key, time.time() - max_age, *TERMINAL_STATUSES)).fetchone()
+        return row[0] if row else None
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
@@ -0,0 +1,171 @@
+import json
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+from telemetry import metrics, record_span
+
+
+class ReadinessTimeout(Exception):
+    pass
+
+
+# Probe raise lỗi này khi tài nguyên/job đã thất bại hẳn, không cần chờ thêm
+class ReadinessFailed(Exception):
+    pass
+
+
+# Chính sách backoff: tăng theo cấp số nhân, có jitter và trần
+class BackoffPolicy:
+    def __init__(self, initial_delay=0.5, factor=2.0, max_delay=8.0, timeout=60.0, jitter=0.5):
+        self.initial_delay = initial_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.jitter = jitter
+
+    # Sinh ra các khoảng chờ liên tiếp (giây)
+    def delays(self):
+        delay = self.initial_delay
+        while True:
+            spread = delay * self.jitter
+            yield delay - spread + random.uniform(0, spread)
+            delay = min(delay * self.factor, self.max_delay)
+
+
+# Mặc định cho từng loại tài nguyên, chỉnh theo số liệu trong readiness_stats.jsonl
+POLICIES = {
+    "resource": BackoffPolicy(initial_delay=0.5, factor=2.0, max_delay=4.0, timeout=60.0),
+    "workflow_job": BackoffPolicy(initial_delay=2.0, factor=1.5, max_delay=5.0, timeout=180.0),
+    "txt2img_job": BackoffPolicy(initial_delay=2.0, factor=1.5, max_delay=5.0, timeout=300.0),
+}
+
+
+# Ghi lại thời gian thực tế để tài nguyên/job sẵn sàng
+class ReadinessStats:
+    def __init__(self, log_path=None, history=500):
+        self.log_path = Path(log_path) if log_path else None
+        self.history = history
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._load()
+
+    # Nạp các mẫu gần nhất từ log để ước tính thời gian ngay từ lúc khởi động
+    def _load(self):
+        if not self.log_path or not self.log_path.exists():
+            return
+        try:
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        sample = json.loads(line)
+                        self._samples.setdefault(sample["kind"], []).append(sample)
+        except (OSError, ValueError) as e:
+            print(f"Readiness stats log unreadable: {e}")
+        for kind in self._samples:
+            self._samples[kind] = self._samples[kind][-self.history:]
+
+    def record(self, kind, name, elapsed, attempts, ready):
+        sample = {"ts": time.time(), "kind": kind, "name": name,
+                  "elapsed": round(elapsed, 3), "attempts": attempts, "ready": ready}
+        with self._lock:
+            samples = self._samples.setdefault(kind, [])
+            samples.append(sample)
+            del samples[:-self.history]
+            if self.log_path:
+                self.log_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(sample) + "\n")
+
+    # Thời gian điển hình (p50) để một loại tài nguyên/job sẵn sàng, None nếu chưa có số liệu
+    def typical(self, kind):
+        with self._lock:
+            elapsed = [s["elapsed"] for s in self._samples.get(kind, []) if s["ready"]]
+        return percentile(elapsed, 50)
+
+    def summary(self):
+        with self._lock:
+            samples = {kind: list(items) for kind, items in self._samples.items()}
+        return summarize(samples)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(samples_by_kind):
+    report = {}
+    for kind, samples in samples_by_kind.items():
+        elapsed = [s["elapsed"] for s in samples if s["ready"]]
+        report[kind] = {
+            "count": len(samples),
+            "timeouts": sum(1 for s in samples if not s["ready"]),
+            "p50": percentile(elapsed, 50),
+            "p95": percentile(elapsed, 95),
+            "max": max(elapsed) if elapsed else None,
+            "mean_attempts": round(sum(s["attempts"] for s in samples) / len(samples), 2),
+        }
+    return report
+
+
+# Gọi probe cho tới khi trả về giá trị khác None/False, chờ theo policy giữa các lần gọi.
+# Lỗi trong probe được coi là "chưa sẵn sàng" (trừ ReadinessFailed); hết timeout thì raise ReadinessTimeout.
+def wait_until_ready(probe, kind, name, policy=None, stats=None):
+    policy = policy or POLICIES.get(kind) or BackoffPolicy()
+    start = time.time()
+    attempts = 0
+    last_error = None
+    for delay in policy.delays():
+        attempts += 1
+        try:
+            result = probe()
+            if result:
+                elapsed = time.time() - start
+                print(f"{kind} {name} ready after {elapsed:.1f}s ({attempts} probes)")
+                if stats:
+                    stats.record(kind, name, elapsed, attempts, True)
+                _record_wait(kind, name, elapsed, attempts)
+                return result
+        except ReadinessFailed:
+            if stats:
+                stats.record(kind, name, time.time() - start, attempts, False)
+            _record_wait(kind, name, time.time() - start, attempts, "ReadinessFailed")
+            raise
+        except Exception as e:
+            last_error = e
+            print(f"{kind} {name} probe {attempts} not ready: {str(e)}")
+        elapsed = time.time() - start
+        if elapsed + delay > policy.timeout:
+            break
+        time.sleep(delay)
+    elapsed = time.time() - start
+    if stats:
+        stats.record(kind, name, elapsed, attempts, False)
+    metrics.inc('tensorart_timeouts_total', kind=kind)
+    _record_wait(kind, name, elapsed, attempts, "ReadinessTimeout")
+    detail = f": {last_error}" if last_error else ""
+    raise ReadinessTimeout(f"{kind} {name} not ready after {elapsed:.0f}s{detail}")
+
+
+def _record_wait(kind, name, elapsed, attempts, error=None):
+    if attempts > 1:
+        metrics.inc('tensorart_retries_total', attempts - 1, source=f"readiness_{kind}")
+    record_span("readiness_wait", elapsed, error=error, kind=kind, name=name, attempts=attempts)
+
+
+if __name__ == "__main__":
+    # In thống kê từ file log: python readiness.py cache/readiness_stats.jsonl
+    log_file = sys.argv[1] if len(sys.argv) > 1 else "cache/readiness_stats.jsonl"
+    samples = {}
+    with open(log_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                sample = json.loads(line)
+                samples.setdefault(sample["kind"], []).append(sample)
+    print(json.dumps(summarize(samples), indent=2))
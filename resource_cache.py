@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+# Thời gian sống của resource trên TensorArt (khớp với expireSec khi upload)
+RESOURCE_EXPIRE_SEC = 7200
+# Không dùng lại resource sắp hết hạn (job có thể chạy tới vài phút)
+EXPIRY_SAFETY_SEC = 600
+# Khi thời gian còn lại dưới ngưỡng này thì upload lại ở nền
+REFRESH_AHEAD_SEC = 1800
+
+
+# Hàm tính sha256 của nội dung file
+def file_sha256(filepath, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Cache resourceId theo hash nội dung file, lưu bền vững ra file JSON
+class ResourceCache:
+    def __init__(self, cache_path, upload_fn, expire_sec=RESOURCE_EXPIRE_SEC,
+                 safety_sec=EXPIRY_SAFETY_SEC, refresh_ahead_sec=REFRESH_AHEAD_SEC):
+        self.cache_path = Path(cache_path)
+        self.upload_fn = upload_fn
+        self.expire_sec = expire_sec
+        self.safety_sec = safety_sec
+        self.refresh_ahead_sec = refresh_ahead_sec
+        self._lock = threading.Lock()
+        # Ghi file cache lần lượt (nhiều upload song song cùng gọi _save)
+        self._save_lock = threading.Lock()
+        self._key_locks = {}
+        self._refreshing = set()
+        # (path, mtime, size) -> sha256, tránh đọc lại file lớn ở mỗi request
+        self._digests = {}
+        self._entries = self._load()
+        # Tiến độ prewarm cho /readyz: (đã xử lý, tổng số, đã xong)
+        self._prewarm = (0, 0, False)
+
+    def _load(self):
+        if not self.cache_path.exists():
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Resource cache unreadable, starting empty: {e}")
+            return {}
+        now = time.time()
+        return {k: v for k, v in entries.items() if v.get('expires_at', 0) - self.safety_sec > now}
+
+    def _save(self):
+        with self._save_lock:
+            with self._lock:
+                snapshot = dict(self._entries)
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, indent=2)
+            os.replace(tmp_path, self.cache_path)
+
+    # Bỏ các entry không còn dùng được (và hash của file tương ứng); gọi khi đang giữ _lock
+    def _prune(self, now):
+        expired = [digest for digest, entry in self._entries.items() if entry['expires_at'] - self.safety_sec <= now]
+        for digest in expired:
+            del self._entries[digest]
+        if expired:
+            self._digests = {key: digest for key, digest in self._digests.items() if digest in self._entries}
+
+    def _digest(self, filepath):
+        stat = os.stat(filepath)
+        key = (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = file_sha256(filepath)
+            self._digests[key] = digest
+        return digest
+
+    def _key_lock(self, digest):
+        with self._lock:
+            return self._key_locks.setdefault(digest, threading.Lock())
+
+    def _upload(self, digest, filepath):
+        started = time.time()
+        resource_id = self.upload_fn(filepath)
+        if not resource_id:
+            return None
+        with self._lock:
+            self._entries[digest] = {
+                'resource_id': resource_id,
+                'path': str(filepath),
+                'uploaded_at': started,
+                'expires_at': started + self.expire_sec,
+            }
+            self._prune(time.time())
+        self._save()
+        return resource_id
+
+    def _refresh_in_background(self, digest, filepath):
+        with self._lock:
+            if digest in self._refreshing:
+                return
+            self._refreshing.add(digest)
+
+        def worker():
+            try:
+                with self._key_lock(digest):
+                    print(f"Refreshing cached resource for {filepath}")
+                    self._upload(digest, filepath)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(digest)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    # Trả về (resource_id, from_cache); upload nếu chưa có hoặc sắp hết hạn
+    def get(self, filepath):
+        digest = self._digest(filepath)
+        with self._key_lock(digest):
+            with self._lock:
+                entry = self._entries.get(digest)
+            remaining = entry['expires_at'] - time.time() if entry else 0
+            if entry and remaining > self.safety_sec:
+                if remaining < self.refresh_ahead_sec:
+                    self._refresh_in_background(digest, filepath)
+                print(f"Resource cache hit for {filepath}: {entry['resource_id']} ({int(remaining)}s left)")
+                return entry['resource_id'], True
+            print(f"Resource cache miss for {filepath}")
+            return self._upload(digest, filepath), False
+
+    # Upload trước các file chưa có trong cache (chạy ở thread nền)
+    def prewarm(self, filepaths):
+        filepaths = [p for p in filepaths if p and os.path.exists(p)]
+        self._prewarm = (0, len(filepaths), False)
+
+        def worker():
+            for index, filepath in enumerate(filepaths):
+                try:
+                    self.get(filepath)
+                except Exception as e:
+                    print(f"Prewarm failed for {filepath}: {str(e)}")
+                self._prewarm = (index + 1, len(filepaths), False)
+            self._prewarm = (len(filepaths), len(filepaths), True)
+            print(f"Resource cache prewarm finished ({len(filepaths)} files)")
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return thread
+
+    def prewarm_status(self):
+        done, total, finished = self._prewarm
+        return {'done': done, 'total': total, 'finished': finished}
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+# Tạo key cache từ các thành phần quyết định kết quả
+def make_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Cache kết quả trên đĩa, loại bỏ theo LRU khi tổng dung lượng vượt max_bytes.
+# Index giữ trong bộ nhớ (OrderedDict theo thứ tự dùng gần nhất) và lưu ra file JSON.
+# verify_files=False thì get() chỉ tra index trong bộ nhớ, không stat file; thứ tự LRU
+# sau mỗi hit được ghi ra đĩa tối đa mỗi save_interval giây.
+# owns_files=False khi file do nơi khác quản lý (vd. ImageStore): loại bỏ chỉ xoá entry.
+class ResultCache:
+    def __init__(self, index_path, max_bytes, verify_files=True, save_interval=30, owns_files=True):
+        self.index_path = Path(index_path)
+        self.max_bytes = max_bytes
+        self.verify_files = verify_files
+        self.owns_files = owns_files
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+        self._index = self._load()
+        self._total_bytes = sum(entry['size'] for entry in self._index.values())
+        with self._lock:
+            self._evict()
+
+    def _load(self):
+        if not self.index_path.exists():
+            return OrderedDict()
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Result cache index unreadable, starting empty: {e}")
+            return OrderedDict()
+        entries = sorted(entries.items(), key=lambda item: item[1].get('last_used', 0))
+        return OrderedDict((key, entry) for key, entry in entries if os.path.exists(entry['path']))
+
+    def _save(self):
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+        self._saved_at = time.time()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._index:
+            key, entry = self._index.popitem(last=False)
+            self._total_bytes -= entry['size']
+            if self.owns_files:
+                try:
+                    os.remove(entry['path'])
+                except OSError:
+                    pass
+            print(f"Result cache evicted {entry['path']}")
+
+    # Trả về đường dẫn file đã lưu nếu có, đồng thời đếm hit/miss
+    def get(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry and self.verify_files and not os.path.exists(entry['path']):
+                self._index.pop(key)
+                self._total_bytes -= entry['size']
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry['last_used'] = time.time()
+            self._index.move_to_end(key)
+            if entry['last_used'] - self._saved_at >= self.save_interval:
+                self._save()
+            return entry['path']
+
+    def put(self, key, path):
+        size = os.path.getsize(path)
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old:
+                self._total_bytes -= old['size']
+            self._index[key] = {'path': str(path), 'size': size, 'last_used': time.time()}
+            self._total_bytes += size
+            self._evict()
+            self._save()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._index), 'bytes': self._total_bytes}
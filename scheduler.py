@@ -0,0 +1,136 @@
+import asyncio
+import time
+from collections import deque
+
+# Mức ưu tiên: số nhỏ được phục vụ trước
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+
+class QueueFull(Exception):
+    pass
+
+
+# Một request đang chờ (hoặc đang giữ) phần công suất của scheduler
+class Ticket:
+    def __init__(self, session, priority, weight, loop):
+        self.session = session
+        self.priority = priority
+        self.weight = weight
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.released = False
+        self._granted = loop.create_future()
+
+    @property
+    def granted(self):
+        return self._granted.done() and not self._granted.cancelled()
+
+    # Chờ tối đa timeout giây; trả về True nếu đã tới lượt
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(asyncio.shield(self._granted), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.granted
+
+
+# Scheduler đứng giữa UI và các job TensorArt: giới hạn tổng số job chạy cùng lúc
+# (capacity), trong cùng mức ưu tiên thì ưu tiên session đang chiếm ít công suất nhất,
+# và từ chối ngay khi hàng đợi quá dài. Chỉ dùng từ event loop của Gradio nên không cần khoá.
+class FairScheduler:
+    def __init__(self, capacity, max_queue, max_per_session, default_duration=60.0):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_per_session = max_per_session
+        self.rejected = 0
+        self._queues = {}
+        self._in_use = 0
+        self._session_in_use = {}
+        self._avg_duration = default_duration
+
+    def queued(self):
+        return sum(len(tickets) for sessions in self._queues.values() for tickets in sessions.values())
+
+    def _session_count(self, session):
+        return sum(len(sessions.get(session, ())) for sessions in self._queues.values())
+
+    def enqueue(self, session, priority=PRIORITY_NORMAL, weight=1):
+        if self.queued() >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(f"Queue is full ({self.max_queue} waiting)")
+        if self._session_count(session) >= self.max_per_session:
+            self.rejected += 1
+            raise QueueFull(f"Session {session} already has {self.max_per_session} requests waiting")
+        ticket = Ticket(session, priority, max(1, min(weight, self.capacity)), asyncio.get_running_loop())
+        self._queues.setdefault(priority, {}).setdefault(session, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    # Thứ tự phục vụ dự kiến: theo mức ưu tiên; trong mỗi mức chọn session đang dùng
+    # ít công suất nhất (tính cả các lượt đã xếp trước), hoà thì ai chờ lâu hơn
+    def _order(self):
+        usage = dict(self._session_in_use)
+        for priority in sorted(self._queues):
+            queues = {session: deque(tickets) for session, tickets in self._queues[priority].items()}
+            while queues:
+                session = min(queues, key=lambda name: (usage.get(name, 0), queues[name][0].enqueued_at))
+                ticket = queues[session].popleft()
+                if not queues[session]:
+                    del queues[session]
+                usage[session] = usage.get(session, 0) + ticket.weight
+                yield ticket
+
+    def _dispatch(self):
+        while True:
+            head = next(self._order(), None)
+            if head is None or self._in_use + head.weight > self.capacity:
+                return
+            sessions = self._queues[head.priority]
+            sessions[head.session].popleft()
+            if not sessions[head.session]:
+                del sessions[head.session]
+            if not sessions:
+                del self._queues[head.priority]
+            self._in_use += head.weight
+            self._session_in_use[head.session] = self._session_in_use.get(head.session, 0) + head.weight
+            head.granted_at = time.monotonic()
+            head._granted.set_result(True)
+
+    # Trả lại công suất (hoặc rời hàng đợi nếu chưa tới lượt)
+    def release(self, ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted:
+            self._in_use -= ticket.weight
+            self._session_in_use[ticket.session] -= ticket.weight
+            if not self._session_in_use[ticket.session]:
+                del self._session_in_use[ticket.session]
+            duration = time.monotonic() - ticket.granted_at
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+        else:
+            sessions = self._queues.get(ticket.priority, {})
+            tickets = sessions.get(ticket.session)
+            if tickets and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del sessions[ticket.session]
+                if not sessions:
+                    self._queues.pop(ticket.priority, None)
+            ticket._granted.cancel()
+        self._dispatch()
+
+    # (vị trí tính từ 0, thời gian chờ ước tính theo giây)
+    def position(self, ticket):
+        units_ahead = self._in_use
+        for index, queued in enumerate(self._order()):
+            if queued is ticket:
+                rounds = (units_ahead + ticket.weight - 1) // self.capacity
+                return index, rounds * self._avg_duration
+            units_ahead += queued.weight
+        return 0, 0.0
+
+    def stats(self):
+        return {'capacity': self.capacity, 'in_use': self._in_use, 'queued': self.queued(),
+                'rejected': self.rejected, 'avg_duration': round(self._avg_duration, 1)}
@@ -0,0 +1,71 @@
+import threading
+import time
+
+HEALTH_PATH = "/healthz"
+READY_PATH = "/readyz"
+
+
+# Đo thời gian từng giai đoạn khởi động (import, cấu hình, cache, dựng UI...) để in báo cáo
+# và trả về trên /readyz. Tạo càng sớm càng tốt trong app.py để tính cả thời gian import.
+class StartupProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self._lock = threading.Lock()
+        self.phases = []
+        self.ready_after = None
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        with self._lock:
+            self.phases.append((phase, now - self._last))
+            self._last = now
+
+    # Gọi khi server đã nhận request: từ lúc này /readyz trả về 200 dù cache còn đang làm nóng
+    def set_ready(self):
+        if self.ready_after is None:
+            self.mark("server start")
+            self.ready_after = time.perf_counter() - self.started
+            print(self.report())
+
+    @property
+    def ready(self):
+        return self.ready_after is not None
+
+    def report(self):
+        with self._lock:
+            phases = list(self.phases)
+        lines = [f"Startup profile ({sum(duration for _, duration in phases):.2f}s):"]
+        lines.extend(f"  {phase:<24}{duration:>8.3f}s" for phase, duration in phases)
+        return "\n".join(lines)
+
+    def summary(self):
+        with self._lock:
+            phases = {phase: round(duration, 3) for phase, duration in self.phases}
+        return {"ready_after": round(self.ready_after, 3) if self.ready_after is not None else None,
+                "phases": phases}
+
+
+# /healthz: process còn sống. /readyz: 200 khi đã nhận được request (503 trước đó),
+# kèm trạng thái làm nóng do warmup() trả về và profile khởi động
+def create_health_router(profile, warmup=None):
+    from fastapi import APIRouter
+    from fastapi.responses import JSONResponse
+
+    router = APIRouter()
+
+    @router.get(HEALTH_PATH)
+    def health():
+        return {"status": "ok"}
+
+    @router.get(READY_PATH)
+    def ready():
+        body = {"status": "ready" if profile.ready else "starting", "startup": profile.summary()}
+        if warmup:
+            try:
+                body["warmup"] = warmup()
+            except Exception as e:
+                body["warmup"] = {"error": str(e)}
+        return JSONResponse(body, status_code=200 if profile.ready else 503)
+
+    return router
@@ -0,0 +1,144 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# LOG_LEVEL=DEBUG thì in cả body request/response đầy đủ; mặc định chỉ in dòng tóm tắt
+DEBUG = os.getenv('LOG_LEVEL', 'INFO').upper() == 'DEBUG'
+# Nếu đặt, mỗi span được ghi thêm một dòng JSON vào file này
+TRACE_LOG = os.getenv('TRACE_LOG', '')
+# Bucket (giây) của histogram thời gian từng giai đoạn
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+METRICS_PATH = "/metrics"
+
+_trace_id = contextvars.ContextVar('trace_id', default=None)
+
+
+# Counter và histogram trong bộ nhớ, xuất theo định dạng text của Prometheus.
+# Collector là hàm trả về [(tên, kiểu, labels, giá trị)] được gọi lúc scrape (vd. thống kê cache).
+class Metrics:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in self._histograms.items()}
+        samples = [(name, 'counter', dict(labels), value) for (name, labels), value in counters.items()]
+        for collector in self._collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                print(f"Metrics collector error: {str(e)}")
+        typed = set()
+        for name, kind, labels, value in sorted(samples, key=lambda sample: (sample[0], sorted(sample[2].items()))):
+            if name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            labels = dict(labels)
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                lines.append(f"{name}_bucket{_labels(dict(labels, le=bound))} {count}")
+            lines.append(f"{name}_bucket{_labels(dict(labels, le='+Inf'))} {histogram['count']}")
+            lines.append(f"{name}_sum{_labels(labels)} {round(histogram['sum'], 6)}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+_trace_lock = threading.Lock()
+
+
+# Bắt đầu trace mới cho một request UI; các span sau đó (kể cả trong asyncio.to_thread) mang trace id này
+def new_trace():
+    trace_id = uuid.uuid4().hex[:16]
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+def current_trace():
+    return _trace_id.get()
+
+
+# Ghi nhận một giai đoạn đã đo: histogram tensorart_stage_seconds{stage}, đếm lỗi,
+# và dòng JSON trong TRACE_LOG nếu bật (labels phụ chỉ ghi vào trace log)
+def record_span(stage, duration, trace_id=None, error=None, **labels):
+    metrics.observe('tensorart_stage_seconds', duration, stage=stage)
+    if error:
+        metrics.inc('tensorart_stage_errors_total', stage=stage, error=error)
+    if TRACE_LOG:
+        event = {"ts": round(time.time(), 3), "trace": trace_id or _trace_id.get(), "stage": stage,
+                 "duration": round(duration, 4), "error": error, **labels}
+        line = json.dumps(event, default=str) + "\n"
+        with _trace_lock:
+            with open(TRACE_LOG, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+@contextmanager
+def span(stage, **labels):
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record_span(stage, time.perf_counter() - start, error=error, **labels)
+
+
+# Endpoint GET /metrics cho Prometheus
+def create_metrics_router():
+    from fastapi import APIRouter
+    from fastapi.responses import PlainTextResponse
+
+    router = APIRouter()
+
+    @router.get(METRICS_PATH)
+    def metrics_endpoint():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    return router
@@ -0,0 +1,71 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from telemetry import metrics
+
+# (connect, read) mặc định cho mọi request, tránh treo vô hạn
+DEFAULT_TIMEOUT = (5, 30)
+# Số kết nối giữ sẵn tới mỗi host (API, S3 presigned, CDN ảnh)
+POOL_SIZE = 20
+# Chỉ retry các method idempotent; POST tạo resource/job không được gửi lại
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'OPTIONS'])
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# Client dùng chung cho mọi lời gọi TensorArt: một Session với connection pool
+# keep-alive, timeout mặc định, retry cho method idempotent và header xác thực
+class TensorArtClient:
+    def __init__(self, base_url, api_key, pool_size=POOL_SIZE, retries=3, timeout=DEFAULT_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.retries = retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=RETRY_STATUSES,
+                      allowed_methods=RETRY_METHODS, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @property
+    def headers(self):
+        return {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {self.api_key}'
+        }
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    # Gọi API TensorArt (đường dẫn tương đối, có header xác thực)
+    def api(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        headers = dict(self.headers)
+        headers.update(kwargs.pop('headers', None) or {})
+        return self._request(method, self.url(path), headers=headers, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.api('POST', path, **kwargs)
+
+    # Gọi URL ngoài (presigned PUT): không gửi token xác thực
+    def external(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self._request(method, url, **kwargs)
+
+    # Đếm số lần urllib3 đã retry và số lần timeout cho /metrics
+    def _request(self, method, url, **kwargs):
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.Timeout:
+            metrics.inc('tensorart_timeouts_total', kind='http')
+            raise
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and retries.history:
+            metrics.inc('tensorart_retries_total', len(retries.history), source='http')
+        return response
+
+    def put_presigned(self, put_url, data, headers):
+        return self.external('PUT', put_url, data=data, headers=headers, timeout=(5, 120))
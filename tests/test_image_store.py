@@ -0,0 +1,72 @@
+import os
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from image_store import ImageStore
+
+
+def png_bytes(color, size=(32, 32)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def save(store, data, suffix='.png'):
+    return store.save_download(data, suffix).result(timeout=10)
+
+
+def stored_name(index, suffix='.jpg'):
+    return f"{index:032x}{suffix}"
+
+
+def test_scan_ignores_files_the_store_did_not_write(tmp_path):
+    for name in ('1.txt', 'input_1740303485.jpg', 'generated_1700000000.png', stored_name(1) + '.tmp'):
+        (tmp_path / name).write_bytes(b'x' * 100)
+    (tmp_path / stored_name(2)).write_bytes(b'x' * 100)
+    store = ImageStore(tmp_path, max_bytes=10, max_age_sec=3600)
+    assert store.stats()['evicted'] == 1
+    assert sorted(os.listdir(tmp_path)) == sorted(['1.txt', 'input_1740303485.jpg', 'generated_1700000000.png',
+                                                   stored_name(1) + '.tmp'])
+
+
+def test_evicts_least_recently_used_over_size(tmp_path):
+    store = ImageStore(tmp_path, max_bytes=10 ** 6, max_age_sec=3600)
+    first = save(store, png_bytes((255, 0, 0)))
+    second = save(store, png_bytes((0, 255, 0)))
+    store.touch(first)
+    store.max_bytes = os.path.getsize(first) + os.path.getsize(second)
+    third = save(store, png_bytes((0, 0, 255)))
+    assert os.path.exists(first) and os.path.exists(third)
+    assert not os.path.exists(second)
+    assert store.touch(second) is False
+
+
+def test_evicts_expired_files_at_startup(tmp_path):
+    old, new = tmp_path / stored_name(1), tmp_path / stored_name(2)
+    old.write_bytes(b'old')
+    new.write_bytes(b'new')
+    stale = time.time() - 7200
+    os.utime(old, (stale, stale))
+    store = ImageStore(tmp_path, max_bytes=10 ** 6, max_age_sec=3600)
+    assert not old.exists() and new.exists()
+    assert store.stats()['files'] == 1
+
+
+def test_new_file_is_kept_even_when_larger_than_the_budget(tmp_path):
+    store = ImageStore(tmp_path, max_bytes=10, max_age_sec=3600)
+    path = save(store, png_bytes((10, 20, 30)))
+    assert os.path.exists(path)
+    assert store.stats()['files'] == 1
+
+
+def test_save_download_keeps_bytes_in_target_format(tmp_path):
+    store = ImageStore(tmp_path, max_bytes=10 ** 6, max_age_sec=3600)
+    data = png_bytes((1, 2, 3))
+    path = save(store, data, '.png')
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    converted = save(store, data, '.jpg')
+    with Image.open(converted) as image:
+        assert image.format == 'JPEG'
@@ -0,0 +1,83 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import benchmark
+from fake_tensorart import FakeTensorArt
+from readiness import POLICIES, BackoffPolicy
+
+
+@pytest.fixture(scope="module")
+def app_env(tmp_path_factory):
+    fake = FakeTensorArt(port=0, queue_time=0.05, run_time=0.1).start()
+    cwd = os.getcwd()
+    policies = dict(POLICIES)
+    app = benchmark.load_app(fake.api_url, tmp_path_factory.mktemp("app"))
+    for kind in ("resource", "workflow_job"):
+        POLICIES[kind] = BackoffPolicy(initial_delay=0.05, factor=1.0, max_delay=0.05, timeout=10.0, jitter=0.0)
+    yield app, fake
+    POLICIES.update(policies)
+    os.chdir(cwd)
+    fake.stop()
+
+
+# Loại graph của một job workflow, nhận theo node: paste có node 18 (mask nạp sẵn),
+# full có node 13 (dán) nhưng tự tách mask, còn lại là graph chỉ tách mask
+def graph_kind(job):
+    params = job['request']['params']
+    if "18" in params:
+        return "paste"
+    return "full" if "13" in params else "mask"
+
+
+def run_img2img(app, image, product):
+    request = SimpleNamespace(session_hash="test", username=None, query_params={})
+
+    async def main():
+        last = None
+        async for update in app.generate_img2img(request, image, "Wall", "1024x1024", "", False,
+                                                 *benchmark.product_choices(app.IMG2IMG_PRODUCT_GROUPS, [product])):
+            last = update
+        return last
+
+    return asyncio.run(main())
+
+
+def test_product_swaps_reuse_the_mask_from_the_first_full_job(app_env):
+    app, fake = app_env
+    products = [label for labels in app.IMG2IMG_PRODUCT_GROUPS.values() for label in labels][:3]
+    if len(products) < 3:
+        pytest.skip("needs three products with images")
+    image = benchmark.synthetic_image("swap")
+    before = set(fake.jobs)
+    for product in products:
+        message = run_img2img(app, image, product)[0]
+        assert message.startswith("Hoàn tất"), message
+    jobs = [fake.jobs[job_id] for job_id in sorted(set(fake.jobs) - before, key=int)]
+    assert [graph_kind(job) for job in jobs] == ["full", "paste", "paste"]
+
+
+def test_new_photo_waits_for_resource_sync_without_params_check(app_env):
+    app, fake = app_env
+    product = next(iter(app.IMG2IMG_PRODUCT_GROUPS.values()))[0]
+    # Template đã được kiểm tra từ xa một lần
+    run_img2img(app, benchmark.synthetic_image("warm"), product)
+    checks, rejected = fake.params_checks, fake.unsynced_submits
+    fake.resource_sync_time = 0.3
+    try:
+        message = run_img2img(app, benchmark.synthetic_image("sync"), product)[0]
+    finally:
+        fake.resource_sync_time = 0.0
+    assert message.startswith("Hoàn tất"), message
+    assert fake.unsynced_submits > rejected
+    assert fake.params_checks == checks
+
+
+def test_reported_percent_scales_by_field_name(app_env):
+    app, _ = app_env
+    assert app.reported_percent({"runningInfo": {"progress": 0.5}}) == 50
+    assert app.reported_percent({"runningInfo": {"percentage": 1}}) == 1
+    assert app.reported_percent({"percent": 40}) == 40
+    assert app.reported_percent({"status": "RUNNING"}) is None
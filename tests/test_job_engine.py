@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from fake_tensorart import FakeTensorArt
+from job_engine import JobEngine, JobFailed, JobTimeout
+from job_journal import JobJournal
+from readiness import POLICIES, BackoffPolicy
+from tensorart_client import TensorArtClient
+
+KIND = "test_job"
+
+
+@pytest.fixture(autouse=True)
+def fast_policy(monkeypatch):
+    monkeypatch.setitem(POLICIES, KIND, BackoffPolicy(initial_delay=0.05, factor=1.0, max_delay=0.05,
+                                                      timeout=5.0, jitter=0.0))
+
+
+@pytest.fixture
+def fake():
+    server = FakeTensorArt(port=0, queue_time=0.1, run_time=0.2).start()
+    yield server
+    server.stop()
+
+
+def run_job(engine, payload=None, timeout=10.0):
+    return asyncio.run(asyncio.wait_for(engine.run("/jobs", payload or {}, KIND, "test"), timeout))
+
+
+def test_completes_by_polling(fake):
+    engine = JobEngine(TensorArtClient(fake.api_url, "key"))
+    result = run_job(engine)
+    assert result['status'] == 'SUCCESS'
+    assert result['successInfo']['images']
+    assert engine.in_flight() == 0
+
+
+def test_completes_by_webhook(fake):
+    # Poll dự phòng quá thưa để job chỉ có thể kết thúc nhờ callback
+    engine = JobEngine(TensorArtClient(fake.api_url, "key"), fallback_poll_interval=60.0)
+
+    def deliver():
+        while not fake.jobs:
+            time.sleep(0.02)
+        job_id = next(iter(fake.jobs))
+        while fake.job_view(job_id)['status'] != 'SUCCESS':
+            time.sleep(0.02)
+        engine.notify(job_id, fake.job_view(job_id))
+
+    threading.Thread(target=deliver, daemon=True).start()
+    start = time.perf_counter()
+    result = run_job(engine)
+    assert result['status'] == 'SUCCESS'
+    assert time.perf_counter() - start < 5.0
+
+
+def test_failed_job_raises(fake):
+    fake.job_failure_rate = 1.0
+    engine = JobEngine(TensorArtClient(fake.api_url, "key"))
+    with pytest.raises(JobFailed):
+        run_job(engine)
+
+
+def test_times_out_while_running(fake, monkeypatch):
+    monkeypatch.setitem(POLICIES, KIND, BackoffPolicy(initial_delay=0.05, factor=1.0, max_delay=0.05,
+                                                      timeout=0.3, jitter=0.0))
+    fake.run_time = 30.0
+    engine = JobEngine(TensorArtClient(fake.api_url, "key"))
+    with pytest.raises(JobTimeout):
+        run_job(engine)
+
+
+def test_bookkeeping_error_does_not_stall_other_jobs(fake):
+    class BrokenStats:
+        def record(self, *args, **kwargs):
+            raise OSError("disk full")
+
+    engine = JobEngine(TensorArtClient(fake.api_url, "key"), stats=BrokenStats())
+    for _ in range(2):
+        assert run_job(engine)['status'] == 'SUCCESS'
+
+
+def fail_next(fake, count):
+    simulate = fake.simulate
+    remaining = [count]
+
+    def flaky():
+        simulate()
+        if remaining[0] > 0:
+            remaining[0] -= 1
+            return True
+        return False
+
+    fake.simulate = flaky
+
+
+def test_download_retries_server_errors(fake):
+    engine = JobEngine(TensorArtClient(fake.api_url, "key"))
+    url = run_job(engine)['successInfo']['images'][0]['url']
+    fail_next(fake, 2)
+    content = asyncio.run(engine.download(url))
+    assert content.startswith(b'\x89PNG')
+
+
+def test_download_gives_up_after_retries(fake):
+    engine = JobEngine(TensorArtClient(fake.api_url, "key", retries=1))
+    url = run_job(engine)['successInfo']['images'][0]['url']
+    fail_next(fake, 5)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(engine.download(url))
+
+
+def test_identical_keys_share_one_job(fake):
+    engine = JobEngine(TensorArtClient(fake.api_url, "key"))
+
+    async def main():
+        return await asyncio.gather(*(engine.run("/jobs", {}, KIND, "test", key="same") for _ in range(2)))
+
+    first, second = asyncio.run(asyncio.wait_for(main(), 10.0))
+    assert len(fake.jobs) == 1
+    assert first['id'] == second['id'] and first['status'] == 'SUCCESS'
+    assert engine._by_key == {} and engine.in_flight() == 0
+
+
+def test_failed_submit_releases_key(fake):
+    engine = JobEngine(TensorArtClient(fake.api_url, "key"))
+    fail_next(fake, 1)
+    with pytest.raises(Exception):
+        asyncio.run(engine.run("/jobs", {}, KIND, "test", key="retry"))
+    assert engine._by_key == {}
+    assert asyncio.run(engine.run("/jobs", {}, KIND, "test", key="retry"))['status'] == 'SUCCESS'
+    assert len(fake.jobs) == 1
+
+
+def test_restart_resumes_running_journal_job(fake, tmp_path):
+    job_id = fake.create_job({})['job']['id']
+    journal = JobJournal(tmp_path / "jobs.sqlite3")
+    journal.record(job_id, "k", KIND, "test", 'RUNNING')
+    engine = JobEngine(TensorArtClient(fake.api_url, "key"), journal=journal)
+    result = asyncio.run(asyncio.wait_for(engine.run("/jobs", {}, KIND, "test", key="k"), 10.0))
+    assert result['id'] == job_id and result['status'] == 'SUCCESS'
+    assert list(fake.jobs) == [job_id]
+    assert journal.stats() == {'SUCCESS': 1}
+
+
+@pytest.mark.parametrize("job_state", ["failed", "unknown"])
+def test_restart_resubmits_finished_or_unknown_journal_job(fake, tmp_path, job_state):
+    if job_state == "failed":
+        job_id = fake.create_job({})['job']['id']
+        fake.jobs[job_id].update(created=time.time() - 60, failed=True)
+    else:
+        job_id = "799999999999999999"
+    journal = JobJournal(tmp_path / "jobs.sqlite3")
+    journal.record(job_id, "k", KIND, "test", 'RUNNING')
+    engine = JobEngine(TensorArtClient(fake.api_url, "key"), journal=journal)
+    result = asyncio.run(asyncio.wait_for(engine.run("/jobs", {}, KIND, "test", key="k"), 10.0))
+    assert result['id'] != job_id and result['status'] == 'SUCCESS'
+    assert journal.find_active("k", 60) is None
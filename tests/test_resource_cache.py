@@ -0,0 +1,62 @@
+import threading
+import time
+
+from resource_cache import ResourceCache
+
+
+def make_files(tmp_path, count):
+    paths = []
+    for index in range(count):
+        path = tmp_path / f"texture_{index}.jpg"
+        path.write_bytes(f"texture {index}".encode())
+        paths.append(str(path))
+    return paths
+
+
+def test_concurrent_uploads_all_succeed(tmp_path):
+    uploads = []
+
+    def upload(filepath):
+        uploads.append(filepath)
+        return f"res-{len(uploads)}"
+
+    cache = ResourceCache(tmp_path / "cache.json", upload)
+    paths = make_files(tmp_path, 40)
+    results, errors = [], []
+
+    def worker(path):
+        try:
+            results.append(cache.get(path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(path,)) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(results) == 40 and all(resource_id for resource_id, _ in results)
+    assert len(ResourceCache(tmp_path / "cache.json", upload)._entries) == 40
+
+
+def test_same_file_is_uploaded_once(tmp_path):
+    uploads = []
+    cache = ResourceCache(tmp_path / "cache.json", lambda path: uploads.append(path) or "res-1")
+    path = make_files(tmp_path, 1)[0]
+    assert cache.get(path) == ("res-1", False)
+    assert cache.get(path) == ("res-1", True)
+    assert len(uploads) == 1
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = ResourceCache(tmp_path / "cache.json", lambda path: "res", expire_sec=100, safety_sec=10,
+                          refresh_ahead_sec=0)
+    old, new = make_files(tmp_path, 2)
+    cache.get(old)
+    for entry in cache._entries.values():
+        entry['expires_at'] = time.time() - 1
+    cache.get(new)
+    assert [entry['path'] for entry in cache._entries.values()] == [new]
+    assert set(cache._digests.values()) == set(cache._entries)
+    assert len(ResourceCache(tmp_path / "cache.json", lambda path: "res", expire_sec=100, safety_sec=10)._entries) == 1
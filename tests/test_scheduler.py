@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, FairScheduler, QueueFull
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_grants_up_to_capacity():
+    async def main():
+        scheduler = FairScheduler(capacity=2, max_queue=10, max_per_session=5)
+        first = scheduler.enqueue("a")
+        second = scheduler.enqueue("b")
+        third = scheduler.enqueue("c")
+        assert first.granted and second.granted
+        assert not third.granted
+        assert scheduler.stats()['in_use'] == 2
+        assert scheduler.stats()['queued'] == 1
+    run(main())
+
+
+def test_release_admits_next_ticket():
+    async def main():
+        scheduler = FairScheduler(capacity=1, max_queue=10, max_per_session=5)
+        first = scheduler.enqueue("a")
+        second = scheduler.enqueue("b")
+        assert not await second.wait(0.01)
+        scheduler.release(first)
+        assert await second.wait(0.01)
+        scheduler.release(second)
+        assert scheduler.stats()['in_use'] == 0
+    run(main())
+
+
+def test_release_is_idempotent():
+    async def main():
+        scheduler = FairScheduler(capacity=1, max_queue=10, max_per_session=5)
+        ticket = scheduler.enqueue("a")
+        scheduler.release(ticket)
+        scheduler.release(ticket)
+        assert scheduler.stats()['in_use'] == 0
+    run(main())
+
+
+def test_leaving_the_queue_frees_the_slot():
+    async def main():
+        scheduler = FairScheduler(capacity=1, max_queue=10, max_per_session=5)
+        running = scheduler.enqueue("a")
+        waiting = scheduler.enqueue("b")
+        scheduler.release(waiting)
+        assert scheduler.stats()['queued'] == 0
+        assert not waiting.granted
+        later = scheduler.enqueue("c")
+        scheduler.release(running)
+        assert later.granted
+    run(main())
+
+
+def test_high_priority_served_first():
+    async def main():
+        scheduler = FairScheduler(capacity=1, max_queue=10, max_per_session=5)
+        running = scheduler.enqueue("a")
+        normal = scheduler.enqueue("b", PRIORITY_NORMAL)
+        high = scheduler.enqueue("c", PRIORITY_HIGH)
+        assert scheduler.position(high)[0] == 0
+        assert scheduler.position(normal)[0] == 1
+        scheduler.release(running)
+        assert high.granted and not normal.granted
+    run(main())
+
+
+def test_least_served_session_goes_first():
+    async def main():
+        scheduler = FairScheduler(capacity=2, max_queue=10, max_per_session=5)
+        running = scheduler.enqueue("busy")
+        scheduler.enqueue("busy")
+        busy_next = scheduler.enqueue("busy")
+        other = scheduler.enqueue("other")
+        # "busy" đang giữ công suất nên "other" được xếp trước dù tới sau
+        assert scheduler.position(other)[0] == 0
+        assert scheduler.position(busy_next)[0] == 1
+        scheduler.release(running)
+        assert other.granted and not busy_next.granted
+    run(main())
+
+
+def test_weight_is_capped_at_capacity():
+    async def main():
+        scheduler = FairScheduler(capacity=2, max_queue=10, max_per_session=5)
+        heavy = scheduler.enqueue("a", weight=5)
+        assert heavy.granted and heavy.weight == 2
+        light = scheduler.enqueue("b")
+        assert not light.granted
+    run(main())
+
+
+def test_rejects_when_queue_is_full():
+    async def main():
+        scheduler = FairScheduler(capacity=1, max_queue=1, max_per_session=5)
+        scheduler.enqueue("a")
+        scheduler.enqueue("b")
+        with pytest.raises(QueueFull):
+            scheduler.enqueue("c")
+        assert scheduler.stats()['rejected'] == 1
+    run(main())
+
+
+def test_rejects_too_many_per_session():
+    async def main():
+        scheduler = FairScheduler(capacity=1, max_queue=10, max_per_session=1)
+        scheduler.enqueue("a")
+        scheduler.enqueue("a")
+        with pytest.raises(QueueFull):
+            scheduler.enqueue("a")
+        scheduler.enqueue("b")
+    run(main())
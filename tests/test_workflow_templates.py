@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from workflow_templates import TemplateRegistry, WorkflowTemplate
+from workflow_validator import WorkflowInvalid
+
+PARAMS = {
+    "2": {"classType": "TensorArt_LoadImage", "inputs": {"image": "{{image}}", "upload": "image"}},
+    "3": {"classType": "TensorArt_PromptText", "inputs": {"Text": "{{prompt}}"}},
+    "7": {"classType": "PreviewImage", "inputs": {"images": ["2", 0]}},
+}
+
+
+def test_render_fills_slots():
+    template = WorkflowTemplate("mask", "mask-v1", PARAMS)
+    params = json.loads(template.render(image="res-1", prompt='wall "left"'))
+    assert params["2"]["inputs"]["image"] == "res-1"
+    assert params["3"]["inputs"]["Text"] == 'wall "left"'
+    assert params["7"] == PARAMS["7"]
+
+
+def test_render_requires_every_slot():
+    template = WorkflowTemplate("mask", "mask-v1", PARAMS)
+    with pytest.raises(KeyError):
+        template.render(image="res-1")
+
+
+def test_invalid_graph_is_rejected_at_load():
+    params = dict(PARAMS)
+    del params["7"]
+    with pytest.raises(WorkflowInvalid):
+        WorkflowTemplate("mask", "mask-v1", params, source="broken.json")
+
+
+def test_fingerprint_ignores_slot_values():
+    first = WorkflowTemplate("mask", "mask-v1", PARAMS)
+    second = WorkflowTemplate("mask", "mask-v1", json.loads(json.dumps(PARAMS)))
+    assert first.fingerprint == second.fingerprint
+    assert first.render(image="a", prompt="b") != first.render(image="c", prompt="d")
+
+
+def test_registry_picks_surface_variant(tmp_path):
+    for version, surfaces in (("mask-v1", None), ("mask-floor-v1", ["Floor"])):
+        spec = {"name": "mask", "version": version, "params": PARAMS}
+        if surfaces:
+            spec["surfaces"] = surfaces
+        (tmp_path / f"{version}.json").write_text(json.dumps(spec), encoding="utf-8")
+    registry = TemplateRegistry(tmp_path)
+    assert registry.get("mask", "Floor").version == "mask-floor-v1"
+    assert registry.get("mask", "Wall").version == "mask-v1"
+    assert registry.version_key("Floor", ["mask"]) == "mask-floor-v1"
+    with pytest.raises(KeyError):
+        registry.get("paste")
+
+
+def test_shipped_templates_load():
+    registry = TemplateRegistry()
+    for name in ("mask", "full", "full_pretiled", "paste", "paste_pretiled"):
+        assert registry.get(name, "Wall").slot_names
+
+
+def test_floor_uses_the_cheaper_segmentation_in_every_graph_that_segments():
+    registry = TemplateRegistry()
+    for name in ("mask", "full", "full_pretiled"):
+        template = registry.get(name, "Floor")
+        assert "floor" in template.version
+        assert '"max_megapixels":1' in template.skeleton
@@ -0,0 +1,108 @@
+import copy
+import json
+
+import pytest
+
+from workflow_validator import ParamsChecker, fingerprint, validate_graph
+
+GRAPH = {
+    "2": {"classType": "TensorArt_LoadImage", "inputs": {"image": "res-1", "upload": "image"}},
+    "3": {"classType": "TensorArt_PromptText", "inputs": {"Text": "wall"}},
+    "4": {"classType": "LayerMask: LoadSegmentAnythingModels",
+          "inputs": {"grounding_dino_model": "GroundingDINO_SwinT_OGC (694MB)", "sam_model": "sam_vit_h (2.56GB)"}},
+    "5": {"classType": "LayerMask: SegmentAnythingUltra V3",
+          "inputs": {"image": ["2", 0], "prompt": ["3", 0], "sam_models": ["4", 0]}},
+    "6": {"classType": "MaskToImage", "inputs": {"mask": ["5", 1]}},
+    "7": {"classType": "PreviewImage", "inputs": {"images": ["6", 0]}},
+}
+
+
+def graph():
+    return copy.deepcopy(GRAPH)
+
+
+def test_valid_graph_has_no_errors():
+    assert validate_graph(graph()) == []
+
+
+def test_rejects_empty_params():
+    assert validate_graph({}) == ["Workflow params must be a non-empty object"]
+
+
+def test_missing_required_input():
+    params = graph()
+    params["2"]["inputs"]["image"] = ""
+    assert validate_graph(params) == ["Node 2 (TensorArt_LoadImage): missing input 'image'"]
+
+
+def test_reference_to_missing_node():
+    params = graph()
+    params["7"]["inputs"]["images"] = ["99", 0]
+    assert validate_graph(params) == ["Node 7: input 'images' references missing node 99"]
+
+
+def test_reference_to_output_out_of_range():
+    params = graph()
+    params["6"]["inputs"]["mask"] = ["5", 2]
+    assert validate_graph(params) == ["Node 6: input 'mask' uses output 2 of node 5"]
+
+
+def test_input_must_be_reference():
+    params = graph()
+    params["7"]["inputs"]["images"] = "6"
+    assert "Node 7 (PreviewImage): input 'images' must be a node reference" in validate_graph(params)
+
+
+def test_missing_output_node():
+    params = graph()
+    del params["7"]
+    assert validate_graph(params) == ["Workflow has no output node"]
+
+
+def test_cycle():
+    params = graph()
+    params["6"]["inputs"]["mask"] = ["8", 0]
+    params["8"] = {"classType": "MaskToImage", "inputs": {"mask": ["6", 0]}}
+    assert validate_graph(params) == ["Workflow graph contains a cycle"]
+
+
+def test_fingerprint_ignores_volatile_inputs():
+    params = graph()
+    params["2"]["inputs"]["image"] = "res-2"
+    params["3"]["inputs"]["Text"] = "floor"
+    assert fingerprint(params) == fingerprint(graph())
+
+
+def test_fingerprint_changes_with_structure():
+    params = graph()
+    params["7"]["inputs"]["images"] = ["2", 0]
+    assert fingerprint(params) != fingerprint(graph())
+
+
+class StubTemplate:
+    version = "mask-v1"
+    fingerprint = "abc123"
+
+
+def test_remote_check_runs_once_per_template(tmp_path):
+    calls = []
+    memo = tmp_path / "memo.json"
+    checker = ParamsChecker(calls.append, memo)
+    rendered = json.dumps(graph())
+    checker.check_template(StubTemplate(), rendered)
+    checker.check_template(StubTemplate(), rendered)
+    assert calls == [graph()]
+    assert checker.stats() == {'remote_checks': 1, 'skipped': 1, 'templates': 1}
+    # Kết quả được lưu ra file nên process mới không gọi lại
+    ParamsChecker(calls.append, memo).check_template(StubTemplate(), rendered)
+    assert len(calls) == 1
+
+
+def test_failed_remote_check_is_not_memoized():
+    def reject(params):
+        raise Exception("Params check failed")
+
+    checker = ParamsChecker(reject)
+    with pytest.raises(Exception):
+        checker.check_template(StubTemplate(), json.dumps(graph()))
+    assert checker.stats()['templates'] == 0
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, HTTPException, Request
+
+CALLBACK_PATH = "/tensorart/callback"
+
+
+# Lấy (job_id, dict job) từ body callback; chấp nhận cả {"job": {...}} lẫn dạng phẳng
+def parse_callback(body):
+    if not isinstance(body, dict):
+        return None, {}
+    job = body.get('job') if isinstance(body.get('job'), dict) else body
+    job_id = job.get('id') or job.get('jobId') or body.get('jobId')
+    return (str(job_id) if job_id else None), job
+
+
+# URL để gửi trong runningNotifyUrl; rỗng nếu chưa cấu hình địa chỉ public
+def callback_url(public_base_url, secret):
+    if not public_base_url:
+        return ""
+    return f"{public_base_url.rstrip('/')}{CALLBACK_PATH}?token={secret}"
+
+
+# Endpoint nhận callback trạng thái job từ TensorArt và đánh thức request đang chờ
+def create_callback_router(job_engine, secret):
+    router = APIRouter()
+
+    @router.post(CALLBACK_PATH)
+    async def tensorart_callback(request: Request, token: str = ""):
+        if token != secret:
+            raise HTTPException(status_code=403, detail="Invalid callback token")
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        job_id, job = parse_callback(body)
+        if not job_id:
+            raise HTTPException(status_code=400, detail="Missing job id")
+        job_engine.notify(job_id, job)
+        return {"ok": True}
+
+    return router
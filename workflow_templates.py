@@ -0,0 +1,87 @@
+import hashlib
+import json
+import re
+from pathlib import Path
+
+from workflow_validator import OUTPUT_NODES, WorkflowInvalid, validate_graph
+
+# Mỗi file workflows/*.json là một template graph có phiên bản:
+#   {"name": "mask", "version": "mask-v1", "surfaces": ["Floor"], "outputs": ["mask"], "params": {...}}
+# Giá trị "{{slot}}" trong params được điền theo từng request (resourceId, prompt).
+# Template không khai báo surfaces là mặc định cho mọi bề mặt của tên đó.
+# outputs đặt tên cho các ảnh trong successInfo theo thứ tự node xuất ảnh (id node tăng dần);
+# không khai báo thì graph chỉ có một ảnh "result".
+TEMPLATE_DIR = "workflows"
+SLOT_PATTERN = re.compile(r'"\{\{(\w+)\}\}"')
+
+
+# Template đã biên dịch: params được serialize một lần thành skeleton JSON,
+# kèm vị trí (offset) các slot để mỗi request chỉ cần nối chuỗi
+class WorkflowTemplate:
+    def __init__(self, name, version, params, surfaces=(), source=None, outputs=("result",)):
+        errors = validate_graph(params)
+        output_nodes = sum(1 for node in params.values() if isinstance(node, dict) and node.get('classType') in OUTPUT_NODES)
+        if not errors and output_nodes != len(outputs):
+            errors.append(f"{len(outputs)} output name(s) declared for {output_nodes} output node(s)")
+        if errors:
+            raise WorkflowInvalid([f"{source or version}: {error}" for error in errors])
+        self.name = name
+        self.version = version
+        self.surfaces = tuple(surface.lower() for surface in surfaces)
+        self.outputs = tuple(outputs)
+        self.source = source
+        self.skeleton = json.dumps(params, sort_keys=True, separators=(',', ':'))
+        self.slots = [(match.start(), match.end(), match.group(1)) for match in SLOT_PATTERN.finditer(self.skeleton)]
+        self.slot_names = {slot for _, _, slot in self.slots}
+        self.fingerprint = hashlib.sha256(self.skeleton.encode()).hexdigest()
+
+    # Trả về params dạng chuỗi JSON với các slot đã được điền
+    def render(self, **values):
+        missing = self.slot_names - values.keys()
+        if missing:
+            raise KeyError(f"Template {self.version} missing slot values: {', '.join(sorted(missing))}")
+        parts = []
+        position = 0
+        for start, end, slot in self.slots:
+            parts.append(self.skeleton[position:start])
+            parts.append(json.dumps(values[slot]))
+            position = end
+        parts.append(self.skeleton[position:])
+        return ''.join(parts)
+
+
+# Nạp toàn bộ template một lần lúc khởi động và chọn template theo tên + bề mặt
+class TemplateRegistry:
+    def __init__(self, template_dir=TEMPLATE_DIR):
+        self.template_dir = Path(template_dir)
+        self._templates = {}
+        for path in sorted(self.template_dir.glob('*.json')):
+            with open(path, 'r', encoding='utf-8') as f:
+                spec = json.load(f)
+            template = WorkflowTemplate(spec['name'], spec['version'], spec['params'],
+                                        spec.get('surfaces', ()), str(path), spec.get('outputs', ("result",)))
+            variants = self._templates.setdefault(template.name, {})
+            for surface in template.surfaces or (None,):
+                if surface in variants:
+                    raise ValueError(f"Duplicate workflow template {template.name} for surface {surface}: "
+                                     f"{variants[surface].source} and {path}")
+                variants[surface] = template
+        print(f"Loaded workflow templates: {self.summary()}")
+
+    def get(self, name, surface=None):
+        variants = self._templates.get(name)
+        if not variants:
+            raise KeyError(f"Unknown workflow template {name}")
+        template = variants.get(str(surface).lower()) if surface else None
+        template = template or variants.get(None)
+        if template is None:
+            raise KeyError(f"No workflow template {name} for surface {surface}")
+        return template
+
+    # Chuỗi phiên bản của các template dùng cho một bề mặt, để đưa vào key cache kết quả
+    def version_key(self, surface, names):
+        return "+".join(self.get(name, surface).version for name in names)
+
+    def summary(self):
+        return {name: sorted(template.version for template in variants.values())
+                for name, variants in self._templates.items()}
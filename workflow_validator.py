@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+# Schema cục bộ của các node mà app dùng: input bắt buộc, input phải là tham chiếu ["id", index],
+# và số output của node (để kiểm tra index trong tham chiếu). Node lạ chỉ được kiểm tra cấu trúc chung.
+NODE_SCHEMAS = {
+    "TensorArt_LoadImage": {"required": ("image",), "references": (), "outputs": 2},
+    "TensorArt_PromptText": {"required": ("Text",), "references": (), "outputs": 1},
+    "LayerMask: LoadSegmentAnythingModels": {"required": ("grounding_dino_model", "sam_model"),
+                                             "references": (), "outputs": 1},
+    "LayerMask: SegmentAnythingUltra V3": {"required": ("image", "prompt", "sam_models"),
+                                           "references": ("image", "prompt", "sam_models"), "outputs": 2},
+    "Image Seamless Texture": {"required": ("images", "blending", "tiled", "tiles"),
+                               "references": ("images",), "outputs": 1},
+    "Paste By Mask": {"required": ("image_base", "image_to_paste", "mask"),
+                      "references": ("image_base", "image_to_paste", "mask"), "outputs": 1},
+    "MaskToImage": {"required": ("mask",), "references": ("mask",), "outputs": 1},
+    "PreviewImage": {"required": ("images",), "references": ("images",), "outputs": 0},
+}
+# Graph phải có ít nhất một node xuất ảnh
+OUTPUT_NODES = ("PreviewImage", "SaveImage")
+# Các input đổi theo từng request (resourceId, prompt); không tính vào fingerprint
+VOLATILE_INPUTS = {("TensorArt_LoadImage", "image"), ("TensorArt_PromptText", "Text")}
+
+
+class WorkflowInvalid(Exception):
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def _is_reference(value):
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+# Kiểm tra graph ngay trên máy; trả về danh sách lỗi (rỗng nếu hợp lệ)
+def validate_graph(params):
+    if not isinstance(params, dict) or not params:
+        return ["Workflow params must be a non-empty object"]
+    errors = []
+    edges = {}
+    for node_id, node in params.items():
+        if not isinstance(node, dict) or not isinstance(node.get('classType'), str) or not node['classType']:
+            errors.append(f"Node {node_id}: missing classType")
+            continue
+        inputs = node.get('inputs')
+        if not isinstance(inputs, dict):
+            errors.append(f"Node {node_id} ({node['classType']}): inputs must be an object")
+            continue
+        schema = NODE_SCHEMAS.get(node['classType'], {})
+        for name in schema.get('required', ()):
+            if inputs.get(name) in (None, ""):
+                errors.append(f"Node {node_id} ({node['classType']}): missing input '{name}'")
+        for name in schema.get('references', ()):
+            if name in inputs and not _is_reference(inputs[name]):
+                errors.append(f"Node {node_id} ({node['classType']}): input '{name}' must be a node reference")
+        edges[node_id] = []
+        for name, value in inputs.items():
+            if not _is_reference(value):
+                continue
+            source_id, index = value
+            source = params.get(source_id)
+            if not isinstance(source, dict):
+                errors.append(f"Node {node_id}: input '{name}' references missing node {source_id}")
+                continue
+            outputs = NODE_SCHEMAS.get(source.get('classType'), {}).get('outputs')
+            if index < 0 or (outputs is not None and index >= outputs):
+                errors.append(f"Node {node_id}: input '{name}' uses output {index} of node {source_id}")
+            edges[node_id].append(source_id)
+    if not any(isinstance(node, dict) and node.get('classType') in OUTPUT_NODES for node in params.values()):
+        errors.append("Workflow has no output node")
+    if not errors and _has_cycle(edges):
+        errors.append("Workflow graph contains a cycle")
+    return errors
+
+
+def _has_cycle(edges):
+    state = {}
+
+    def visit(node_id):
+        state[node_id] = 1
+        for source_id in edges.get(node_id, ()):
+            if state.get(source_id) == 1 or (source_id not in state and visit(source_id)):
+                return True
+        state[node_id] = 2
+        return False
+
+    return any(node_id not in state and visit(node_id) for node_id in edges)
+
+
+# Fingerprint cấu trúc của graph: node, classType, tham chiếu và giá trị cố định,
+# bỏ qua các input đổi theo request (VOLATILE_INPUTS)
+def fingerprint(params):
+    structure = {}
+    for node_id, node in params.items():
+        inputs = {name: ("<volatile>" if (node['classType'], name) in VOLATILE_INPUTS else value)
+                  for name, value in node['inputs'].items()}
+        structure[node_id] = [node['classType'], inputs]
+    return hashlib.sha256(json.dumps(structure, sort_keys=True).encode()).hexdigest()
+
+
+# Graph đã được validate cục bộ lúc nạp template; chỉ gọi params check từ xa lần đầu gặp mỗi
+# (phiên bản template, fingerprint), kết quả lưu ra file để dùng lại sau khi khởi động lại
+class ParamsChecker:
+    def __init__(self, remote_check, memo_path=None):
+        self.remote_check = remote_check
+        self.memo_path = Path(memo_path) if memo_path else None
+        self.remote_checks = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._checked = self._load()
+
+    def _load(self):
+        if not self.memo_path or not self.memo_path.exists():
+            return set()
+        try:
+            with open(self.memo_path, 'r', encoding='utf-8') as f:
+                return set(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Params check memo unreadable, starting empty: {e}")
+            return set()
+
+    def _save(self):
+        if not self.memo_path:
+            return
+        self.memo_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.memo_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(sorted(self._checked), f)
+        os.replace(tmp_path, self.memo_path)
+
+    # Graph dựng từ template đã biên dịch (đã validate lúc nạp): fingerprint chính là hash skeleton,
+    # chỉ parse chuỗi params khi thật sự cần gọi kiểm tra từ xa
+    def check_template(self, template, rendered_params):
+        self._check_once(f"{template.version}:{template.fingerprint}", template.version,
+                         lambda: json.loads(rendered_params))
+
+    def _check_once(self, key, template_version, load_params):
+        with self._lock:
+            if key in self._checked:
+                self.skipped += 1
+                return
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = threading.Event()
+        if pending is not None:
+            # Một request khác đang kiểm tra đúng cấu trúc này: chờ rồi dùng kết quả của nó
+            pending.wait()
+            return self._check_once(key, template_version, load_params)
+        try:
+            self.remote_check(load_params())
+            with self._lock:
+                self.remote_checks += 1
+                self._checked.add(key)
+                self._save()
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+        print(f"Workflow template {template_version} passed remote params check ({key[-12:]})")
+
+    def stats(self):
+        with self._lock:
+            return {'remote_checks': self.remote_checks, 'skipped': self.skipped, 'templates': len(self._checked)}